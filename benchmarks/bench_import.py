@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+"""Measure how long importing the nousagi discoverer takes.
+
+Runs ``python -X importtime`` in fresh interpreters, and prints a JSON
+summary with the median total time and the slowest modules, in
+microseconds::
+
+    python benchmarks/bench_import.py --repeat 10
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import json
+import subprocess
+import sys
+
+DEFAULT_MODULE = 'nousagi.discoverer'
+
+
+def import_times(module):
+    """Return ``{module name: cumulative microseconds}`` for one import of
+    ``module`` in a fresh interpreter.
+
+    """
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import ' + module]
+    output = subprocess.check_output(
+        cmd, stderr=subprocess.STDOUT, universal_newlines=True,
+    )
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            # The header line.
+            continue
+        times[fields[2].strip()] = cumulative
+    return times
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default=DEFAULT_MODULE)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    modules = set().union(*runs)
+    medians = dict(
+        (name, _median([run.get(name, 0) for run in runs]))
+        for name in modules
+    )
+    slowest = sorted(
+        (name for name in modules if name != args.module),
+        key=lambda name: medians[name], reverse=True,
+    )[:args.top]
+    json.dump({
+        'benchmark': 'import',
+        'module': args.module,
+        'python': sys.version.split()[0],
+        'repeat': args.repeat,
+        'total_us': medians.get(args.module),
+        'slowest_us': [[name, medians[name]] for name in slowest],
+    }, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+"""Measure the memory used by a large generated suite.
+
+Test files of no-op tests are generated in a temporary directory, and
+discovered in process. A JSON report is printed, with the memory held by
+the discovered suite, the peak memory allocated while discovering it, and
+the memory held once every test has also been built, as when the whole
+suite runs::
+
+    python benchmarks/bench_memory.py --tests 100000
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import gc
+import json
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from haas.loader import Loader
+
+from nousagi.discoverer import CLITestDiscoverer
+from nousagi.scheduler import iter_generated_tests
+
+from bench_suite import generate_many_tests
+
+
+def _traced_memory():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def run_benchmark(test_count):
+    directory = tempfile.mkdtemp(prefix="nousagi-bench-")
+    try:
+        generate_many_tests(directory, test_count)
+        discoverer = CLITestDiscoverer(Loader())
+
+        tracemalloc.start()
+        baseline = _traced_memory()
+        start = time.perf_counter()
+        suite = discoverer.discover(directory)
+        discovery_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        suite_memory = _traced_memory() - baseline
+
+        start = time.perf_counter()
+        tests = [test for test, _ in iter_generated_tests(suite)]
+        for test in tests:
+            test.test
+        build_time = time.perf_counter() - start
+        built_memory = _traced_memory() - baseline
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(directory)
+
+    return {
+        "tests": len(tests),
+        "discovery_s": discovery_time,
+        "discovery_peak_memory_bytes": peak_memory - baseline,
+        "suite_memory_bytes": suite_memory,
+        "suite_memory_per_test_bytes": suite_memory / max(len(tests), 1),
+        "build_s": build_time,
+        "built_suite_memory_bytes": built_memory,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--tests", type=int, default=100000,
+        help="Number of tests to generate (default: 100000)",
+    )
+    args = parser.parse_args(argv)
+
+    # Pay for the modules imported on first use before measuring.
+    run_benchmark(1)
+    result = run_benchmark(args.tests)
+    result.update({
+        "benchmark": "memory",
+        "python": sys.version.split()[0],
+    })
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+"""Measure the overhead of discovering, loading and running nousagi tests.
+
+Synthetic test files are generated in a temporary directory for each
+benchmark, then discovered and run in process. A JSON report is printed,
+with for each benchmark the discovery time, the peak memory allocated while
+building the suite, and the time spent per no-op command beyond running
+the command itself::
+
+    python benchmarks/bench_suite.py --scale 0.1 many_tests var_chain
+
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+from haas.loader import Loader
+
+from nousagi.discoverer import CLITestDiscoverer
+
+# The command every generated test runs through the shell; it does nothing.
+NOOP_COMMAND = "true"
+
+TESTS_PER_FILE = 100
+
+
+def _write_spec(directory, name, spec):
+    # JSON is valid YAML, and much faster to write.
+    filename = os.path.join(directory, "test_{0}.yml".format(name))
+    with open(filename, "w") as fh:
+        json.dump(spec, fh)
+
+
+def _noop_test(name):
+    return {"name": name, "cmd": NOOP_COMMAND, "status": 0}
+
+
+# Each generator writes test files in ``directory``, and returns the number
+# of no-op commands they run.
+
+
+def generate_many_tests(directory, count):
+    """``count`` tests, split in files of ``TESTS_PER_FILE`` tests."""
+    for start in range(0, count, TESTS_PER_FILE):
+        tests = [
+            _noop_test("test_{0}".format(index))
+            for index in range(start, min(start + TESTS_PER_FILE, count))
+        ]
+        _write_spec(directory, "many_{0}".format(start), {
+            "cases": [{"name": "many", "tests": tests}],
+        })
+    return count
+
+
+def generate_scenario_chain(directory, count):
+    """A single scenario of ``count`` steps."""
+    steps = [_noop_test("step_{0}".format(index)) for index in range(count)]
+    _write_spec(directory, "scenario", {
+        "cases": [{
+            "name": "chain",
+            "scenarios": [{"name": "chain", "steps": steps}],
+        }],
+    })
+    return count
+
+
+def generate_pre_run_definitions(directory, count):
+    """``count`` pre-run definitions, each used by one test."""
+    definitions = dict(
+        ("setup_{0}".format(index), [
+            {"type": "env", "name": "NOUSAGI_BENCH", "value": str(index)},
+        ])
+        for index in range(count)
+    )
+    cases = [
+        {
+            "name": "case_{0}".format(index),
+            "setup": ["setup_{0}".format(index)],
+            "tests": [_noop_test("test")],
+        }
+        for index in range(count)
+    ]
+    _write_spec(directory, "pre_runs", {
+        "pre_run_definitions": definitions, "cases": cases,
+    })
+    return count
+
+
+def generate_large_output(directory, count):
+    """A test writing ``count`` megabytes of output, checked by a regex."""
+    script = (
+        "import sys\n"
+        "chunk = b'x' * (1 << 20)\n"
+        "for _ in range({0}):\n"
+        "    sys.stdout.buffer.write(chunk)\n"
+        "sys.stdout.buffer.write(b'done')\n"
+    ).format(count)
+    _write_spec(directory, "large_output", {
+        "cases": [{
+            "name": "large_output",
+            "tests": [{
+                "name": "large_output",
+                "exec": [sys.executable, "-c", script],
+                "assertions": [{"type": "regex", "expected": "done$$"}],
+            }],
+        }],
+    })
+    return 0
+
+
+def generate_var_chain(directory, count):
+    """``count`` vars, each referencing the previous one."""
+    variables = {"var_0": "x"}
+    for index in range(1, count):
+        variables["var_{0}".format(index)] = "${{var_{0}}}x".format(index - 1)
+    _write_spec(directory, "var_chain", {
+        "config": {"vars": variables},
+        "cases": [{
+            "name": "var_chain",
+            "tests": [{
+                "name": "last_var",
+                "cmd": "{0} ${{var_{1}}}".format(NOOP_COMMAND, count - 1),
+                "status": 0,
+            }],
+        }],
+    })
+    return 1
+
+
+# name -> (generator, size at scale 1)
+BENCHMARKS = {
+    "many_tests": (generate_many_tests, 10000),
+    "scenario_chain": (generate_scenario_chain, 1000),
+    "pre_run_definitions": (generate_pre_run_definitions, 1000),
+    "large_output": (generate_large_output, 256),
+    "var_chain": (generate_var_chain, 3000),
+}
+
+
+def command_time(repeat):
+    """The mean time to run ``NOOP_COMMAND`` directly, through the shell,
+    in seconds.
+
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        subprocess.check_call(NOOP_COMMAND, shell=True)
+    return (time.perf_counter() - start) / repeat
+
+
+def _count_tests(suite):
+    if isinstance(suite, unittest.TestCase):
+        return 1
+    return sum(_count_tests(test) for test in suite)
+
+
+def run_benchmark(name, size, jobs):
+    generator, _ = BENCHMARKS[name]
+    directory = tempfile.mkdtemp(prefix="nousagi-bench-")
+    try:
+        command_count = generator(directory, size)
+        discoverer = CLITestDiscoverer(Loader(), jobs=jobs)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        suite = discoverer.discover(directory)
+        discovery_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        result = unittest.TestResult()
+        start = time.perf_counter()
+        suite.run(result)
+        run_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(directory)
+
+    test_count = _count_tests(suite)
+    return {
+        "size": size,
+        "tests": test_count,
+        "errors": len(result.errors),
+        "failures": len(result.failures),
+        "discovery_s": discovery_time,
+        "suite_peak_memory_bytes": peak_memory,
+        "run_s": run_time,
+        "commands": command_count,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "benchmarks", nargs="*", metavar="BENCHMARK",
+        help="The benchmarks to run, among {0} (default: all)".format(
+            ", ".join(sorted(BENCHMARKS))),
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0,
+        help="Multiply the size of every benchmark (default: 1)",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1,
+        help="Number of tests run concurrently (default: 1)",
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if len(unknown) > 0:
+        parser.error("Unknown benchmarks: {0}".format(
+            ", ".join(sorted(unknown))))
+
+    baseline = command_time(100)
+    # Pay for the modules imported on first use before measuring.
+    run_benchmark("many_tests", 1, args.jobs)
+
+    results = {}
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        size = max(1, int(BENCHMARKS[name][1] * args.scale))
+        result = run_benchmark(name, size, args.jobs)
+        if result["commands"] > 0:
+            # The time spent by the harness around each command.
+            result["overhead_per_command_s"] = (
+                result["run_s"] / result["commands"] - baseline
+            )
+        results[name] = result
+
+    json.dump({
+        "benchmark": "suite",
+        "python": sys.version.split()[0],
+        "scale": args.scale,
+        "jobs": args.jobs,
+        "command_s": baseline,
+        "results": results,
+    }, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
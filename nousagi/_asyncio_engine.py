@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import signal
+import threading
+
+from .capture import CapturedOutput
+from .process import (
+    KILL_GRACE_PERIOD, NEW_SESSION_KWARGS, READ_SIZE, CommandResult,
+    is_stop_requested, kill_process_group, popen_kwargs, running_processes,
+    signal_process_group, stream_writer
+)
+
+DEFAULT_MAX_PROCESSES = 64
+
+
+class AsyncioEngine(object):
+    """Run commands on a single asyncio event loop.
+
+    The loop lives in a daemon thread and supervises every child process,
+    while at most ``max_processes`` children are alive at once. Callers
+    still block on a future until their command is done, so each command
+    in flight holds one caller thread: concurrency comes from the threads
+    of the scheduler.
+
+    Parameters
+    ----------
+    max_processes : int, optional
+        The maximum number of child processes running at the same time.
+
+    """
+    def __init__(self, max_processes=None):
+        super(AsyncioEngine, self).__init__()
+        if max_processes is None:
+            max_processes = DEFAULT_MAX_PROCESSES
+        self.max_processes = max_processes
+        self._lock = threading.Lock()
+        self._loop = None
+        self._semaphore = None
+
+    def run(self, cmd, env=None, timeout=None, watcher=None):
+        finished = threading.Event()
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(cmd, env, timeout, watcher, finished), self._get_loop()
+        )
+        try:
+            return future.result()
+        except BaseException:
+            # Cancelling the future cancels the coroutine in the loop, which
+            # kills its command: wait for it, as the loop thread dies with
+            # the process.
+            future.cancel()
+            finished.wait(KILL_GRACE_PERIOD)
+            raise
+
+    async def _run(self, cmd, env, timeout, watcher, finished):
+        try:
+            return await self._run_command(cmd, env, timeout, watcher)
+        finally:
+            finished.set()
+
+    async def _run_command(self, cmd, env, timeout, watcher):
+        # Created from within the loop so it binds to it on every python 3
+        # version.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_processes)
+        async with self._semaphore:
+            process = await _create_subprocess(
+                cmd, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                stdin=asyncio.subprocess.PIPE, env=env, **NEW_SESSION_KWARGS
+            )
+            process.stdin.close()
+            running_processes.add(process)
+            output = CapturedOutput()
+            stop = asyncio.Event()
+            pump = asyncio.ensure_future(
+                self._pump(process, output, watcher, stop)
+            )
+            stop_requested = asyncio.ensure_future(stop.wait())
+            try:
+                await asyncio.wait(
+                    [pump, stop_requested], timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                stop_requested.cancel()
+                is_done = pump.done()
+                if not is_done:
+                    await self._kill(process, pump)
+                await pump
+            except BaseException:
+                # The child leads its own session, so an interrupt from the
+                # terminal never reaches it: kill it rather than orphan it.
+                stop_requested.cancel()
+                pump.cancel()
+                kill_process_group(process)
+                await process.wait()
+                raise
+            finally:
+                cancelled = running_processes.remove(process)
+        output.finish()
+        stopped = not is_done and is_stop_requested(watcher)
+        return CommandResult(
+            output=output, returncode=process.returncode,
+            timed_out=not (is_done or stopped), stopped=stopped,
+            cancelled=cancelled,
+        )
+
+    async def _pump(self, process, output, watcher, stop):
+        def copy(stream, name, write):
+            write = stream_writer(write, watcher, name)
+            return _copy(stream, write, watcher, stop)
+
+        await asyncio.gather(
+            copy(process.stdout, 'stdout', output.write_stdout),
+            copy(process.stderr, 'stderr', output.write_stderr),
+        )
+        await process.wait()
+
+    async def _kill(self, process, pump):
+        signal_process_group(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.shield(pump), KILL_GRACE_PERIOD)
+        except asyncio.TimeoutError:
+            kill_process_group(process)
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="nousagi-asyncio-engine"
+                )
+                thread.daemon = True
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+
+def _create_subprocess(cmd, **kwargs):
+    if popen_kwargs(cmd)['shell']:
+        return asyncio.create_subprocess_shell(cmd, **kwargs)
+    return asyncio.create_subprocess_exec(*cmd, **kwargs)
+
+
+async def _copy(stream, write, watcher, stop):
+    while True:
+        data = await stream.read(READ_SIZE)
+        if not data:
+            break
+        write(data)
+        if is_stop_requested(watcher):
+            stop.set()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+"""The server of the ``python-forkserver`` runner.
+
+Run as a script by the interpreter of the CLI under test, so it only uses
+the standard library. It imports the modules given as arguments once, then
+reads one JSON request per line on stdin, and for each forks a child
+running an entry point. It replies on stdout with one JSON line holding the
+pid of the child, then one holding its return code once it exited.
+
+"""
+from __future__ import absolute_import, unicode_literals
+
+import importlib
+import json
+import os
+import sys
+import traceback
+
+
+def main(modules):
+    # The protocol gets its own descriptors, so that anything the preloaded
+    # modules print cannot corrupt it.
+    requests = os.fdopen(os.dup(0), "rb")
+    replies = os.fdopen(os.dup(1), "wb")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+
+    for module in modules:
+        importlib.import_module(module)
+
+    for line in iter(requests.readline, b""):
+        request = json.loads(line.decode("utf-8"))
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            requests.close()
+            replies.close()
+            _run_child(request, devnull)
+        _reply(replies, {"pid": pid})
+        _, status = os.waitpid(pid, 0)
+        _reply(replies, {"returncode": _returncode(status)})
+
+
+def _reply(replies, reply):
+    replies.write(json.dumps(reply).encode("utf-8") + b"\n")
+    replies.flush()
+
+
+def _returncode(status):
+    # Same convention as subprocess: killed by a signal is negative.
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _run_child(request, devnull):
+    code = 1
+    try:
+        # Lead a new session, so the whole process tree of the test can be
+        # signalled at once, as with the subprocess engine.
+        os.setsid()
+        for fd, filename in ((1, request["stdout"]), (2, request["stderr"])):
+            target = os.open(filename, os.O_WRONLY | os.O_TRUNC)
+            os.dup2(target, fd)
+            os.close(target)
+        os.close(devnull)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        sys.argv = request["argv"]
+        code = _exit_code(_call(request["entry_point"]))
+    except SystemExit as e:
+        code = _exit_code(e.code)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _call(entry_point):
+    module_name, _, attributes = entry_point.partition(":")
+    target = importlib.import_module(module_name)
+    for attribute in attributes.split("."):
+        target = getattr(target, attribute)
+    return target()
+
+
+def _exit_code(code):
+    # Same convention as sys.exit, as console scripts call
+    # sys.exit(entry_point()).
+    if code is None:
+        return 0
+    elif isinstance(code, int):
+        return code & 0xff
+    sys.stderr.write("{0}\n".format(code))
+    return 1
+
+
+if __name__ == "__main__":
+    # The directory of this script, first in sys.path, holds nousagi's
+    # modules, which must not shadow those of the CLI under test.
+    del sys.path[0]
+    main(sys.argv[1:])
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+# THIS FILE IS GENERATED FROM SETUP.PY
+version = '0.1.0'
+full_version = '0.1.0.dev27'
+git_revision = 'd3cefaf78c0b9acea9b2d1db9f630af55981dfc4'
+is_released = False
+
+if not is_released:
+    version = full_version
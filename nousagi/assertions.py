@@ -1,15 +1,33 @@
 import abc
 import os.path
-import string
-import subprocess
 
-from characteristic import Attribute, attributes
 from haas.utils import abstractclassmethod
 from six import add_metaclass
 
+from .capture import join_output, to_bytes
+from .process import (
+    CANCELLED_MESSAGE, command_from_json_dict, prerender_command,
+    render_command, run_command
+)
+from .slotted import Slotted, check_type
+from .streaming import PrefixMatcher
+from .templates import compile_regex, prerender_template, render_template
+
+# How much of the output is shown when an output assertion fails.
+MAX_REPORTED_OUTPUT = 2048
+
+
+def _head(output):
+    head = output.read(MAX_REPORTED_OUTPUT)
+    if len(output) > MAX_REPORTED_OUTPUT:
+        head += b"..."
+    return head
+
 
 @add_metaclass(abc.ABCMeta)
-class IAssertion(object):
+class IAssertion(Slotted):
+    __slots__ = ()
+
     @abstractclassmethod
     def from_json_dict(cls, variables, data):
         """Create the assertion from a variables set and the loaded json
@@ -21,87 +39,106 @@ class IAssertion(object):
 
     @abc.abstractmethod
     def uphold(self, variables, case, stdout, stder, returncode):
-        """ The method to call to check the assertion."""
+        """ The method to call to check the assertion.
+
+        ``stdout`` and ``stderr`` are ``OutputView`` instances, so that
+        large outputs are never copied into python strings.
+        """
+
+    def stream_matcher(self, variables):
+        """Return a matcher fed with the output while the command runs, to
+        stop it as soon as the assertion is known to fail, or ``None`` if the
+        assertion cannot be checked early.
+        """
+        return None
 
 
-@attributes([
-    Attribute("variables", instance_of=dict),
-    Attribute("expected", instance_of=int)
-])
 class StatusAssertion(IAssertion):
+    __slots__ = ("variables", "expected")
+
     @classmethod
     def from_json_dict(cls, variables, data):
+        check_type("expected", data["expected"], int)
         return cls(variables=variables, expected=data["expected"])
 
     def uphold(self, variables, case, stdout, stderr, returncode):
         case.assertEqual(self.expected, returncode)
 
 
-@attributes([
-    Attribute("variables", instance_of=dict),
-    Attribute("expected", instance_of=str)
-])
 class OutputAssertion(IAssertion):
+    __slots__ = ("variables", "expected")
+
     @classmethod
     def from_json_dict(cls, variables, data):
+        check_type("output", data["output"], str)
+        prerender_template(data["output"], variables)
         return cls(variables=variables, expected=data["output"])
 
     def uphold(self, variables, case, stdout, stderr, returncode):
-        output = "\n".join((stdout, stderr))
-        case.assertTrue(output.startswith(self._render()))
+        output = join_output(stdout, stderr)
+        case.assertTrue(output.startswith(to_bytes(self._render(variables))))
+
+    def stream_matcher(self, variables):
+        return PrefixMatcher(to_bytes(self._render(variables)))
 
-    def _render(self):
-        return string.Template(self.expected).substitute(self.variables)
+    def _render(self, variables):
+        return render_template(self.expected, variables)
 
 
-@attributes([
-    Attribute("variables", instance_of=dict),
-    Attribute("expected", instance_of=str)
-])
 class OutputStartswithAssertion(IAssertion):
+    __slots__ = ("variables", "expected")
+
     @classmethod
     def from_json_dict(cls, variables, data):
+        check_type("expected", data["expected"], str)
+        prerender_template(data["expected"], variables)
         return cls(variables=variables, expected=data["expected"])
 
-    def render(self):
-        return string.Template(self.expected).substitute(self.variables)
+    def render(self, variables):
+        return render_template(self.expected, variables)
 
     def uphold(self, variables, case, stdout, stderr, returncode):
-        output = "\n".join((stdout, stderr))
-        case.assertTrue(output.startswith(self.render()))
+        output = join_output(stdout, stderr)
+        case.assertTrue(output.startswith(to_bytes(self.render(variables))))
+
+    def stream_matcher(self, variables):
+        return PrefixMatcher(to_bytes(self.render(variables)))
 
 
-@attributes([
-    Attribute("variables", instance_of=dict),
-    Attribute("expected", instance_of=str)
-])
 class RegexOutputAssertion(IAssertion):
+    __slots__ = ("variables", "expected")
+
     @classmethod
     def from_json_dict(cls, variables, data):
+        check_type("expected", data["expected"], str)
+        prerender_template(data["expected"], variables)
         return cls(variables=variables, expected=data["expected"])
 
     def uphold(self, variables, case, stdout, stderr, returncode):
-        output = "\n".join((stdout, stderr))
-        return case.assertRegexpMatches(output.rstrip(), self._render().rstrip())
+        output = join_output(stdout, stderr)
+        regex = compile_regex(to_bytes(self._render(variables).rstrip()))
+        if output.search(regex, rstrip=True) is None:
+            msg = "Regexp didn't match: {0!r} not found in {1!r}"
+            case.fail(msg.format(regex.pattern, _head(output)))
 
-    def _render(self):
-        return string.Template(self.expected).substitute(self.variables)
+    def _render(self, variables):
+        return render_template(self.expected, variables)
 
 
-@attributes([
-    Attribute("variables", instance_of=dict),
-    Attribute("path", instance_of=str),
-    Attribute("exists", instance_of=bool)
-])
 class FileExists(IAssertion):
+    __slots__ = ("variables", "path", "exists")
+
     @classmethod
     def from_json_dict(cls, variables, data):
+        check_type("path", data["path"], str)
+        check_type("exists", data["exists"], bool)
+        prerender_template(data["path"], variables)
         return cls(
             variables=variables, path=data["path"], exists=data["exists"]
         )
 
     def uphold(self, variables, case, stdout, stderr, returncode):
-        path = self._render_path()
+        path = self._render_path(variables)
         if self.exists:
             msg = "File {0!r} does not exist".format(path)
             case.assertTrue(os.path.exists(path), msg)
@@ -109,17 +146,13 @@ class FileExists(IAssertion):
             msg = "File {0!r} exists".format(path)
             case.assertFalse(os.path.exists(path), msg)
 
-    def _render_path(self):
-        return string.Template(self.path).substitute(self.variables)
+    def _render_path(self, variables):
+        return render_template(self.path, variables)
 
 
-@attributes([
-    Attribute("variables", instance_of=dict),
-    Attribute("status", instance_of=int),
-    Attribute("command", instance_of=str),
-    Attribute("assertions", instance_of=list)
-])
 class CommandAssertion(IAssertion):
+    __slots__ = ("variables", "status", "command", "assertions")
+
     @classmethod
     def from_json_dict(cls, variables, data):
         generic_assertions_factory = {
@@ -139,21 +172,28 @@ class CommandAssertion(IAssertion):
                 assertion = factory.from_json_dict(variables, assertion_data)
                 assertions.append(assertion)
 
+        check_type("status", data["status"], int)
+        command = command_from_json_dict(data, "command")
+        prerender_command(command, variables)
         return cls(
             variables=variables, status=data["status"],
-            command=data["command"], assertions=assertions,
+            command=command, assertions=assertions,
         )
 
     def uphold(self, variables, case, stdout, stderr, returncode):
-        command = self._render_command()
-        p = subprocess.Popen(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            shell=True,
-        )
-        stdout, stderr = p.communicate()
-
-        for assertion in self.assertions:
-            assertion.uphold(variables, case, stdout, stderr, p.returncode)
-
-    def _render_command(self):
-        return string.Template(self.command).substitute(self.variables)
+        command = self._render_command(variables)
+        result = run_command(command)
+
+        try:
+            if result.cancelled:
+                case.skipTest(CANCELLED_MESSAGE)
+            for assertion in self.assertions:
+                assertion.uphold(
+                    variables, case, result.stdout, result.stderr,
+                    result.returncode
+                )
+        finally:
+            result.output.close()
+
+    def _render_command(self, variables):
+        return render_command(self.command, variables)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import io
+import mmap
+import shutil
+import tempfile
+
+import six
+
+# Output beyond this many bytes per stream is spilled to a temporary file.
+MAX_IN_MEMORY_SIZE = 4 * 1024 ** 2
+
+_WHITESPACE = frozenset(b" \t\n\r\x0b\x0c")
+
+
+def to_bytes(text):
+    """Encode ``text`` as utf-8, to compare it with captured output."""
+    if isinstance(text, six.text_type):
+        return text.encode("utf-8")
+    return text
+
+
+class _SpoolFile(object):
+    """A binary file kept in memory until it grows past ``max_size``."""
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._file = io.BytesIO()
+        self.is_spilled = False
+
+    def write(self, data):
+        self._file.write(data)
+        if not self.is_spilled and self._file.tell() > self._max_size:
+            spill = tempfile.TemporaryFile()
+            spill.write(self._file.getbuffer())
+            self._file = spill
+            self.is_spilled = True
+
+    def tell(self):
+        return self._file.tell()
+
+    def seek(self, offset):
+        self._file.seek(offset)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def flush(self):
+        self._file.flush()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def getbuffer(self):
+        return self._file.getbuffer()
+
+    def close(self):
+        self._file.close()
+
+
+class CapturedOutput(object):
+    """The stdout and stderr of a command, with bounded memory usage.
+
+    Once the command is done, the output is laid out as ``stdout``, a
+    newline, then ``stderr``, so that the joined output assertions look at
+    is a single contiguous view, memory-mapped when it was spilled to disk.
+
+    """
+    def __init__(self, max_size=MAX_IN_MEMORY_SIZE):
+        super(CapturedOutput, self).__init__()
+        self._file = _SpoolFile(max_size)
+        self._stderr = _SpoolFile(max_size)
+        self._stdout_size = None
+        self._size = None
+        self._buffer = None
+
+    def write_stdout(self, data):
+        self._file.write(data)
+
+    def write_stderr(self, data):
+        self._stderr.write(data)
+
+    def finish(self):
+        """Mark the end of the output, once the command is done."""
+        if self._size is not None:
+            return
+        self._stdout_size = self._file.tell()
+        self._file.write(b"\n")
+        self._stderr.seek(0)
+        shutil.copyfileobj(self._stderr, self._file)
+        self._stderr.close()
+        self._size = self._file.tell()
+        self._file.flush()
+
+    @property
+    def is_spilled(self):
+        return self._file.is_spilled
+
+    @property
+    def stdout(self):
+        self.finish()
+        return OutputView(self, 0, self._stdout_size)
+
+    @property
+    def stderr(self):
+        self.finish()
+        return OutputView(self, self._stdout_size + 1, self._size)
+
+    @property
+    def joined(self):
+        """stdout and stderr, joined by a newline."""
+        self.finish()
+        return OutputView(self, 0, self._size)
+
+    def buffer(self):
+        """A read-only bytes-like view of the whole output."""
+        self.finish()
+        if self._buffer is None:
+            if not self.is_spilled:
+                self._buffer = self._file.getbuffer()
+            else:
+                self._buffer = mmap.mmap(
+                    self._file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        return self._buffer
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        elif isinstance(self._buffer, memoryview):
+            self._buffer.release()
+        self._buffer = None
+        self._file.close()
+        self._stderr.close()
+
+
+class OutputView(object):
+    """A window on the bytes of a ``CapturedOutput``."""
+    def __init__(self, captured, start, end):
+        super(OutputView, self).__init__()
+        self.captured = captured
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def read(self, size=None):
+        end = self.end if size is None else min(self.end, self.start + size)
+        return bytes(self.captured.buffer()[self.start:end])
+
+    def startswith(self, prefix):
+        if len(prefix) > len(self):
+            return False
+        return self.read(len(prefix)) == prefix
+
+    def search(self, regex, rstrip=False):
+        """Search the compiled bytes ``regex`` in the view, without copying
+        the output.
+
+        """
+        buf = self.captured.buffer()
+        end = self.end
+        if rstrip:
+            while end > self.start and buf[end - 1] in _WHITESPACE:
+                end -= 1
+        return regex.search(buf, self.start, end)
+
+
+def join_output(stdout, stderr):
+    """The view of ``stdout`` and ``stderr`` joined by a newline."""
+    captured = stdout.captured
+    if (captured is stderr.captured and stdout.start == 0
+            and stdout.end + 1 == stderr.start):
+        return captured.joined
+    joined = CapturedOutput()
+    joined.write_stdout(stdout.read())
+    joined.write_stderr(stderr.read())
+    return joined.joined
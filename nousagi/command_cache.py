@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+from six import string_types
+
+logger = logging.getLogger(__name__)
+
+# Environment variables always part of the key of a cached command.
+KEY_ENVIRONMENT = ('PATH',)
+
+
+class CommandCache(object):
+    """A process-wide memo of command outputs, optionally backed by disk.
+
+    Callers asking for the same key at the same time wait for a single
+    computation.
+
+    Parameters
+    ----------
+    directory : str, optional
+        If given, where entries with a time to live are persisted across
+        runs.
+
+    """
+    def __init__(self, directory=None):
+        super(CommandCache, self).__init__()
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = {}
+
+    def get(self, key, ttl, compute):
+        """Return the value cached for ``key``, calling ``compute`` if it is
+        missing or older than ``ttl`` seconds.
+
+        A ``ttl`` of ``None`` keeps the value for the whole session, in
+        memory only.
+
+        """
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry is None and ttl is not None:
+                entry = self._read(key)
+            if entry is not None and _is_fresh(entry, ttl):
+                return entry[1]
+            entry = (time.time(), compute())
+            self._entries[key] = entry
+            if ttl is not None:
+                self._write(key, entry)
+            return entry[1]
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _entry_path(self, key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".pickle")
+
+    def _read(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._entry_path(key), "rb") as fh:
+                stored_key, entry = pickle.load(fh)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            logger.debug('Ignoring corrupted cache entry for %r', key)
+            return None
+        if stored_key != key:
+            return None
+        return entry
+
+    def _write(self, key, entry):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump((key, entry), fh, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._entry_path(key))
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+
+def _is_fresh(entry, ttl):
+    return ttl is None or time.time() - entry[0] < ttl
+
+
+def command_key(command, env_names=()):
+    """The cache key of ``command``: the command itself, the working
+    directory and the relevant environment variables.
+
+    """
+    if not isinstance(command, string_types):
+        command = tuple(command)
+    names = sorted(set(KEY_ENVIRONMENT).union(env_names))
+    environment = tuple((name, os.environ.get(name)) for name in names)
+    return (command, os.getcwd(), environment)
+
+
+command_cache = CommandCache()
+
+
+def set_command_cache_directory(directory):
+    command_cache.directory = directory
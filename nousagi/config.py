@@ -7,7 +7,9 @@
 from __future__ import absolute_import
 
 from characteristic import Attribute, attributes
+from six import string_types
 
+from .forkserver import create_runner
 from .var_loader import VarLoader
 
 
@@ -15,6 +17,7 @@ from .var_loader import VarLoader
     Attribute("is_enabled", instance_of=bool),
     Attribute("coveragerc", instance_of=str),
     Attribute("reset", instance_of=bool),
+    Attribute("parallel", instance_of=bool, default_value=False),
 ])
 class _CoverageConfiguration(object):
     @classmethod
@@ -23,29 +26,54 @@ class _CoverageConfiguration(object):
             is_enabled=data.get("enabled", False),
             coveragerc=data.get("coveragerc", ""),
             reset=data.get("reset", True),
+            parallel=data.get("parallel", False),
         )
 
+    def command(self, name):
+        cmd = ["coverage", name]
+        if len(self.coveragerc) > 0:
+            cmd.extend(["--rcfile", self.coveragerc])
+        return cmd
+
+    @property
+    def prefix_args(self):
+        # In parallel mode, each command writes its own data file, combined
+        # once at the end of the session, instead of appending to a shared
+        # one.
+        prefix = self.command("run")
+        prefix.insert(2, "-p" if self.parallel else "-a")
+        return prefix
+
     @property
     def prefix(self):
-        prefix = ["coverage", "run", "-a"]
-        if len(self.coveragerc) > 0:
-            prefix.extend(["--rcfile", self.coveragerc])
-        return " ".join(prefix)
+        return " ".join(self.prefix_args)
+
+    def prefix_command(self, cmd):
+        if isinstance(cmd, string_types):
+            return self.prefix + " " + cmd
+        return self.prefix_args + cmd
 
 
 class Config(object):
     """Container for the top-level test configuration.
 
     This contains all of the top-level configuration, such as the target
-    host and variables to be used in test cases.
+    host and variables to be used in test cases, the default timeout (in
+    seconds) of every command, whether ``cmd`` strings are run through
+    the shell by default, and the runner of test commands, ``None`` for the
+    process-wide engine.
 
     """
-    def __init__(self, variables, coverage, var_loader, test_filename):
+    def __init__(self, variables, coverage, var_loader, test_filename,
+                 timeout=None, shell=True, runner=None):
         super(Config, self).__init__()
         self.var_loader = var_loader
         self.variables = variables
         self.test_filename = test_filename
         self.coverage = coverage
+        self.timeout = timeout
+        self.shell = shell
+        self.runner = runner
 
     @classmethod
     def from_dict(cls, config_data, test_filename):
@@ -59,6 +87,9 @@ class Config(object):
             variables=variables,
             var_loader=var_loader,
             test_filename=test_filename,
+            timeout=config_data.get("timeout"),
+            shell=config_data.get("shell", True),
+            runner=create_runner(config_data.get("runner")),
         )
 
     def load_variable(self, name, var):
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import atexit
+import logging
+import subprocess
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class CoverageSession(object):
+    """Coverage data bookkeeping shared by every test file of a session.
+
+    Data is erased once per coverage configuration file, rather than once
+    per test file. Configurations running in parallel mode, where each
+    command writes its own data file, are combined once when the session
+    ends.
+
+    """
+    def __init__(self):
+        super(CoverageSession, self).__init__()
+        self._lock = threading.Lock()
+        self._erased = set()
+        self._to_combine = {}
+        self._is_registered = False
+
+    def prepare(self, coverage):
+        """Prepare the coverage data of a test file configured with
+        ``coverage``, a ``_CoverageConfiguration``.
+
+        """
+        if not coverage.is_enabled:
+            return
+        key = coverage.coveragerc
+        with self._lock:
+            if coverage.reset and key not in self._erased:
+                subprocess.check_output(coverage.command("erase"))
+                self._erased.add(key)
+            if coverage.parallel and key not in self._to_combine:
+                self._to_combine[key] = coverage
+                if not self._is_registered:
+                    atexit.register(self.combine)
+                    self._is_registered = True
+
+    def combine(self):
+        """Combine the data files written by parallel mode commands."""
+        with self._lock:
+            to_combine = sorted(self._to_combine.items())
+            self._to_combine = {}
+        for key, coverage in to_combine:
+            cmd = coverage.command("combine")
+            if key not in self._erased:
+                # Keep the data of previous sessions.
+                cmd.append("--append")
+            logger.debug('Combining coverage data: %r', cmd)
+            try:
+                subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.warning('Could not combine coverage data: %s', e)
+
+
+coverage_session = CoverageSession()
@@ -6,16 +6,30 @@
 # of the 3-clause BSD license.  See the LICENSE.txt file for details.
 from __future__ import absolute_import, unicode_literals
 
+import argparse
 import logging
 import os
+import sys
 
 from haas.plugins.discoverer import match_path
 from haas.plugins.i_discoverer_plugin import IDiscovererPlugin
 
+from .command_cache import set_command_cache_directory
+from .durations import DurationHistory
+from .process import ENGINES, create_engine, set_engine
+from .results import result_stream
+from .scheduler import create_scheduler
+from .selection import TestSelection, split_test_path
+from .sharding import Shard, parse_shard
+from .tracing import tracer
+from .yaml_cache import YamlCache
 from .yaml_test_loader import YamlTestLoader
 
 logger = logging.getLogger(__name__)
 
+# Default number of test files loaded concurrently during discovery.
+DEFAULT_DISCOVERY_JOBS = min(32, (os.cpu_count() or 1) + 4)
+
 
 class CLITestDiscoverer(IDiscovererPlugin):
     """A ``haas`` test discovery plugin to generate CLI test cases from
@@ -25,13 +39,74 @@ class CLITestDiscoverer(IDiscovererPlugin):
     ----------
     loader : haas.loader.Loader
         The ``haas`` test loader.
+    jobs : int, optional
+        The number of tests to run concurrently. Scenarios always run
+        their steps in order within a single worker.
+    engine : SubprocessEngine or AsyncioEngine, optional
+        If given, the engine used to run every command of this session.
+    cache_dir : str, optional
+        If given, the directory where parsed test files and the output of
+        command vars with a time to live are cached.
+    discovery_jobs : int, optional
+        The number of test files loaded concurrently.
+    trace : str, optional
+        If given, the file where the time spent in each phase of loading
+        and running tests is written, as a Chrome trace.
+    shard : Shard, optional
+        If given, only the cases of this shard of the suite are loaded.
+    durations : str, optional
+        The duration history file, where the duration of each test is
+        recorded, and from which the longest tests are started first. By
+        default, ``durations.json`` in ``cache_dir``, if given.
+    critical_path : bool, optional
+        If true, print the predicted duration of the run, and the longest
+        chain of tests, once discovery is done.
+    fail_fast : bool, optional
+        If true, the first failing test skips the tests left, and kills the
+        commands still running.
+    selection : TestSelection, optional
+        If given, only the tests it selects are loaded.
+    results : str, optional
+        If given, the JSON Lines file where the result of each test is
+        written as soon as it is done.
+    junit_xml : str, optional
+        If given, the file where a JUnit XML report is written once every
+        test ran, from the results.
 
     """
 
-    def __init__(self, loader, **kwargs):
+    def __init__(self, loader, jobs=1, engine=None, cache_dir=None,
+                 discovery_jobs=DEFAULT_DISCOVERY_JOBS, trace=None,
+                 shard=None, durations=None, critical_path=False,
+                 fail_fast=False, selection=None, results=None,
+                 junit_xml=None, **kwargs):
         super(CLITestDiscoverer, self).__init__(**kwargs)
         self._loader = loader
-        self._yaml_loader = YamlTestLoader(loader)
+        if trace is not None:
+            tracer.start(trace)
+        if results is not None or junit_xml is not None:
+            result_stream.start(results, junit_xml)
+        self._discovery_jobs = discovery_jobs
+        if engine is not None:
+            set_engine(engine)
+        if durations is None and cache_dir is not None:
+            durations = os.path.join(cache_dir, 'durations.json')
+        self._history = None
+        if durations is not None:
+            self._history = DurationHistory(durations)
+        self._critical_path = critical_path
+        self._scheduler = create_scheduler(jobs, self._history, fail_fast)
+        cache = None
+        if cache_dir is not None:
+            cache = YamlCache(cache_dir)
+            set_command_cache_directory(os.path.join(cache_dir, 'commands'))
+        if selection is None:
+            selection = TestSelection()
+        self._selection = selection
+        self._yaml_loader = YamlTestLoader(
+            loader, self._scheduler, cache, case_filter=shard,
+            selection=selection,
+        )
 
     @classmethod
     def from_args(cls, args, arg_prefix, loader):
@@ -47,7 +122,32 @@ class CLITestDiscoverer(IDiscovererPlugin):
             The test loader used to construct TestCase and TestSuite instances.
 
         """
-        return cls(loader)
+        def option(name, default):
+            return getattr(args, '{0}nousagi_{1}'.format(arg_prefix, name),
+                           default)
+
+        engine = create_engine(
+            option('engine', 'subprocess'), option('max_processes', None)
+        )
+        shard = None
+        if option('shard', None) is not None:
+            shard = Shard.from_args(
+                option('shard', None), option('shard_durations', None)
+            )
+        return cls(
+            loader, jobs=option('jobs', 1), engine=engine,
+            cache_dir=option('cache_dir', None),
+            discovery_jobs=option('discovery_jobs', DEFAULT_DISCOVERY_JOBS),
+            trace=option('trace', None), shard=shard,
+            durations=option('durations', None),
+            critical_path=option('critical_path', False),
+            fail_fast=option('fail_fast', False),
+            selection=TestSelection(
+                option('name', None) or [], option('tag', None) or []
+            ),
+            results=option('results', None),
+            junit_xml=option('junit_xml', None),
+        )
 
     @classmethod
     def add_parser_arguments(cls, parser, option_prefix, dest_prefix):
@@ -64,6 +164,94 @@ class CLITestDiscoverer(IDiscovererPlugin):
             plugin should use.
 
         """
+        parser.add_argument(
+            '--nousagi-jobs', type=int, default=1, metavar='N',
+            dest='{0}nousagi_jobs'.format(dest_prefix),
+            help='Number of nousagi tests to run concurrently (default: 1)',
+        )
+        parser.add_argument(
+            '--nousagi-engine', choices=ENGINES, default='subprocess',
+            dest='{0}nousagi_engine'.format(dest_prefix),
+            help='How nousagi runs commands (default: subprocess)',
+        )
+        parser.add_argument(
+            '--nousagi-max-processes', type=int, default=None, metavar='N',
+            dest='{0}nousagi_max_processes'.format(dest_prefix),
+            help=('Maximum number of commands in flight with the asyncio '
+                  'engine (default: 64)'),
+        )
+        parser.add_argument(
+            '--nousagi-cache-dir', default=None, metavar='DIR',
+            dest='{0}nousagi_cache_dir'.format(dest_prefix),
+            help=('Cache parsed test files, and the output of command vars '
+                  'with a ttl, in DIR across runs'),
+        )
+        parser.add_argument(
+            '--nousagi-discovery-jobs', type=int,
+            default=DEFAULT_DISCOVERY_JOBS, metavar='N',
+            dest='{0}nousagi_discovery_jobs'.format(dest_prefix),
+            help=('Number of test files loaded concurrently (default: '
+                  '{0})'.format(DEFAULT_DISCOVERY_JOBS)),
+        )
+        parser.add_argument(
+            '--nousagi-trace', default=None, metavar='FILE',
+            dest='{0}nousagi_trace'.format(dest_prefix),
+            help=('Write the time spent in each phase of each test to FILE, '
+                  'as a Chrome trace, and a summary next to it'),
+        )
+        parser.add_argument(
+            '--nousagi-shard', type=_shard_argument, default=None,
+            metavar='K/N', dest='{0}nousagi_shard'.format(dest_prefix),
+            help='Only load the cases of the K-th of N shards of the suite',
+        )
+        parser.add_argument(
+            '--nousagi-shard-durations', default=None, metavar='FILE',
+            dest='{0}nousagi_shard_durations'.format(dest_prefix),
+            help=('Balance shards using the case durations in FILE, a '
+                  'duration history or a JSON object mapping "path::case" to '
+                  'seconds'),
+        )
+        parser.add_argument(
+            '--nousagi-durations', default=None, metavar='FILE',
+            dest='{0}nousagi_durations'.format(dest_prefix),
+            help=('Record test durations in FILE, and start the longest '
+                  'tests first (default: durations.json in the cache dir)'),
+        )
+        parser.add_argument(
+            '--nousagi-critical-path', action='store_true', default=False,
+            dest='{0}nousagi_critical_path'.format(dest_prefix),
+            help=('Print the predicted duration of the run and its longest '
+                  'chain of tests before running them'),
+        )
+        parser.add_argument(
+            '--nousagi-fail-fast', action='store_true', default=False,
+            dest='{0}nousagi_fail_fast'.format(dest_prefix),
+            help=('Skip the tests left, and kill running commands, as soon '
+                  'as a test fails'),
+        )
+        parser.add_argument(
+            '--nousagi-name', action='append', default=None,
+            metavar='PATTERN', dest='{0}nousagi_name'.format(dest_prefix),
+            help=('Only load the tests whose "case:test" name matches the '
+                  'shell-style PATTERN (may be repeated)'),
+        )
+        parser.add_argument(
+            '--nousagi-tag', action='append', default=None, metavar='TAG',
+            dest='{0}nousagi_tag'.format(dest_prefix),
+            help=('Only load the tests tagged TAG, or in a case tagged TAG '
+                  '(may be repeated)'),
+        )
+        parser.add_argument(
+            '--nousagi-results', default=None, metavar='FILE',
+            dest='{0}nousagi_results'.format(dest_prefix),
+            help=('Write the result of each test to FILE, as JSON Lines, as '
+                  'soon as it is done'),
+        )
+        parser.add_argument(
+            '--nousagi-junit-xml', default=None, metavar='FILE',
+            dest='{0}nousagi_junit_xml'.format(dest_prefix),
+            help='Write a JUnit XML report of the run to FILE at exit',
+        )
 
     def discover(self, start, top_level_directory=None, pattern=None):
         """Discover YAML-formatted Web API tests.
@@ -71,20 +259,36 @@ class CLITestDiscoverer(IDiscovererPlugin):
         Parameters
         ----------
         start : str
-            Directory from which to recursively discover test cases.
+            Directory from which to recursively discover test cases, or a
+            test file, optionally followed by ``::case`` or
+            ``::case::test`` to only load that case or test.
         top_level_directory : None
             Ignored; for API compatibility with haas.
         pattern : None
             Ignored; for API compatibility with haas.
 
         """
+        selection = None
+        if not os.path.exists(start):
+            start, case_name, test_name = split_test_path(start)
+            if case_name is not None:
+                selection = self._selection.within(case_name, test_name)
         if os.path.isdir(start):
             start_directory = start
-            return self._discover_by_directory(start_directory)
+            suite = self._discover_by_directory(start_directory)
         elif os.path.isfile(start):
             start_filepath = start
-            return self._discover_by_file(start_filepath)
-        return self._loader.create_suite()
+            suite = self._discover_by_file(start_filepath, selection)
+        else:
+            return self._loader.create_suite()
+        self._scheduler.add_suite(suite)
+        if self._critical_path:
+            if self._history is None:
+                message = 'No duration history to predict the run from'
+            else:
+                message = self._scheduler.format_prediction()
+            sys.stderr.write(message + '\n')
+        return suite
 
     def _discover_by_directory(self, start_directory):
         """Run test discovery in a directory.
@@ -99,34 +303,60 @@ class CLITestDiscoverer(IDiscovererPlugin):
         tests = self._discover_tests(start_directory)
         return self._loader.create_suite(list(tests))
 
-    def _discover_by_file(self, start_filepath):
+    def _discover_by_file(self, start_filepath, selection=None):
         """Run test discovery on a single file.
 
         Parameters
         ----------
         start_filepath : str
             The module file in which to start test discovery.
+        selection : TestSelection, optional
+            If given, replaces the selection of the discoverer.
 
         """
         start_filepath = os.path.abspath(start_filepath)
         logger.debug('Discovering tests in file: start_filepath=%r',
                      start_filepath)
 
-        tests = self._load_from_file(start_filepath)
+        tests = self._load_from_file(start_filepath, selection)
         return self._loader.create_suite(list(tests))
 
-    def _load_from_file(self, filepath):
+    def _load_from_file(self, filepath, selection=None):
         logger.debug('Loading tests from %r', filepath)
-        tests = self._yaml_loader.load_tests_from_file(filepath)
+        tests = self._yaml_loader.load_tests_from_file(filepath, selection)
         return self._loader.create_suite(tests)
 
     def _discover_tests(self, start_directory):
+        filepaths = list(self._find_test_files(start_directory))
+        if self._discovery_jobs <= 1 or len(filepaths) <= 1:
+            return [self._load_from_file(filepath) for filepath in filepaths]
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(self._discovery_jobs, len(filepaths)))
+        try:
+            # map keeps the order of the files, whatever order they are
+            # loaded in.
+            return pool.map(self._load_from_file, filepaths)
+        finally:
+            pool.close()
+
+    def _find_test_files(self, directory):
         pattern = 'test*.yml'
-        for curdir, dirnames, filenames in os.walk(start_directory):
-            logger.debug('Discovering tests in %r', curdir)
-            for filename in filenames:
-                filepath = os.path.join(curdir, filename)
-                if not match_path(filename, filepath, pattern):
-                    logger.debug('Skipping %r', filepath)
-                    continue
-                yield self._load_from_file(filepath)
+        logger.debug('Discovering tests in %r', directory)
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.is_dir():
+                # Like os.walk, do not follow symbolic links to directories.
+                if not entry.is_symlink():
+                    for filepath in self._find_test_files(entry.path):
+                        yield filepath
+            elif match_path(entry.name, entry.path, pattern):
+                yield entry.path
+            else:
+                logger.debug('Skipping %r', entry.path)
+
+
+def _shard_argument(text):
+    try:
+        parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import atexit
+import heapq
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout of the history file changes.
+HISTORY_VERSION = 1
+
+# Weight of the latest duration of a test in its recorded duration.
+SMOOTHING = 0.5
+
+
+def test_key(case_key, test_name):
+    """The key of the duration of a test, from the key of its case."""
+    return "{0}::{1}".format(case_key, test_name)
+
+
+class DurationHistory(object):
+    """The durations of tests in previous runs, stored in a JSON file.
+
+    Durations are keyed by file, case and test names. The duration of a
+    test that ran again is smoothed with its previous one. Durations
+    recorded by a run are saved when the process exits.
+
+    Parameters
+    ----------
+    filename : str
+        The history file, created if needed.
+
+    """
+    def __init__(self, filename):
+        super(DurationHistory, self).__init__()
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._durations = _read_history(filename)
+        self._recorded = {}
+        self._is_registered = False
+
+    def get(self, key):
+        """The expected duration of a test in seconds, or ``None`` if it
+        never ran.
+
+        """
+        return self._durations.get(key)
+
+    def estimates(self, keys):
+        """The expected durations of tests, where tests that never ran are
+        expected to take the mean duration of those that did.
+
+        """
+        known = [
+            self._durations[key] for key in keys if key in self._durations
+        ]
+        default = sum(known) / len(known) if len(known) > 0 else 0.0
+        return [self._durations.get(key, default) for key in keys]
+
+    def record(self, key, duration):
+        with self._lock:
+            self._recorded[key] = duration
+            if not self._is_registered:
+                atexit.register(self.save)
+                self._is_registered = True
+
+    def save(self):
+        with self._lock:
+            recorded, self._recorded = self._recorded, {}
+        if len(recorded) == 0:
+            return
+        # Read again, for the durations saved by other runs meanwhile.
+        durations = _read_history(self.filename)
+        for key, duration in recorded.items():
+            previous = durations.get(key)
+            if previous is not None:
+                duration = SMOOTHING * duration + (1 - SMOOTHING) * previous
+            durations[key] = duration
+        self._durations = durations
+        _write_history(self.filename, durations)
+
+
+def _read_history(filename):
+    try:
+        with open(filename, "rt") as fh:
+            data = json.load(fh)
+    except (IOError, OSError):
+        return {}
+    except ValueError:
+        logger.warning('Ignoring corrupted duration history %r', filename)
+        return {}
+    if data.get("version") != HISTORY_VERSION:
+        return {}
+    return data["tests"]
+
+
+def _write_history(filename, durations):
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wt") as fh:
+            json.dump({"version": HISTORY_VERSION, "tests": durations}, fh,
+                      indent=0, sort_keys=True)
+        os.replace(temp_path, filename)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def case_durations(data):
+    """The durations of cases, from either a duration history, or a JSON
+    object mapping case keys to seconds.
+
+    """
+    if "tests" not in data:
+        return dict((key, float(value)) for key, value in data.items())
+    durations = {}
+    for key, duration in data["tests"].items():
+        case = key.rsplit("::", 1)[0]
+        durations[case] = durations.get(case, 0.0) + duration
+    return durations
+
+
+def predict(durations, jobs):
+    """Predict the run of jobs of the given ``(name, duration)``, started
+    longest first on ``jobs`` workers.
+
+    Returns
+    -------
+    wall_time : float
+        The time until every job is done.
+    critical_path : list
+        The ``(name, duration)`` of the jobs run by the last worker to be
+        done, in order.
+
+    """
+    workers = [(0.0, index, []) for index in range(max(jobs, 1))]
+    ordered = sorted(
+        enumerate(durations), key=lambda item: (-item[1][1], item[0])
+    )
+    for _, (name, duration) in ordered:
+        total, index, path = heapq.heappop(workers)
+        path.append((name, duration))
+        heapq.heappush(workers, (total + duration, index, path))
+    wall_time, _, critical_path = max(workers)
+    return wall_time, critical_path
+
+
+def format_prediction(durations, jobs):
+    wall_time, critical_path = predict(durations, jobs)
+    total = sum(duration for _, duration in durations)
+    lines = [
+        "Predicted wall time: {0:.1f}s for {1} tests on {2} workers "
+        "({3:.1f}s in total)".format(wall_time, len(durations), jobs, total),
+        "Critical path:",
+    ]
+    for name, duration in critical_path:
+        lines.append("  {0:8.2f}s  {1}".format(duration, name))
+    return "\n".join(lines)
@@ -28,3 +28,11 @@ class VariableLoopError(NousagiTestError):
 
 class InvalidRegistrationVariable(NousagiTestError):
     pass
+
+
+class InvalidScope(NousagiTestError):
+    pass
+
+
+class ForkServerError(NousagiTestError):
+    pass
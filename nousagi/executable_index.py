@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import os
+import threading
+import time
+
+
+# Minimum number of seconds between two checks of the PATH directories
+# modification times.
+CHECK_INTERVAL = 1.0
+
+
+class ExecutableIndex(object):
+    """A process-wide index of the files in ``PATH`` directories.
+
+    Each directory is listed once, and listed again only when its
+    modification time changes. Lookups are remembered, and the
+    modification times are checked at most every ``CHECK_INTERVAL``
+    seconds, so repeated lookups do not touch the filesystem.
+
+    """
+    def __init__(self):
+        super(ExecutableIndex, self).__init__()
+        self._lock = threading.RLock()
+        # normcased directory -> (mtime, set of normcased file names)
+        self._directories = {}
+        # (path, pathext) -> [checked at, {name: found path}]
+        self._lookups = {}
+
+    def which(self, name, path=None, pathext=None):
+        """Return the path of the executable ``name`` in ``path``, or
+        ``None``.
+
+        ``path`` and ``pathext`` default to the ``PATH`` and ``PATHEXT``
+        environment variables.
+
+        """
+        if path is None:
+            path = os.environ.get("PATH", os.defpath)
+        if pathext is None:
+            pathext = os.environ.get("PATHEXT", "")
+        with self._lock:
+            lookups = self._lookups.get((path, pathext))
+            now = time.time()
+            if lookups is None:
+                lookups = self._lookups[(path, pathext)] = [now, {}]
+            elif now - lookups[0] >= CHECK_INTERVAL:
+                lookups[0] = now
+                if self._is_stale(path):
+                    lookups[1] = {}
+            try:
+                return lookups[1][name]
+            except KeyError:
+                found = self._find(name, path, pathext)
+                lookups[1][name] = found
+                return found
+
+    def _find(self, name, path, pathext):
+        candidates = [name + ext.lower() for ext in pathext.split(os.pathsep)]
+        # Names with a directory part are not in any listing, and are
+        # checked on disk.
+        has_directory = os.path.dirname(name) != ""
+
+        for directory in _directories(path):
+            names = None if has_directory else self._list(directory)[1]
+            for candidate in candidates:
+                if names is not None and (
+                        os.path.normcase(candidate) not in names):
+                    continue
+                filename = os.path.join(directory, candidate)
+                if _is_executable(filename):
+                    return filename
+        return None
+
+    def _is_stale(self, path):
+        """Whether any listed directory of ``path`` changed since it was
+        listed, forgetting those that did.
+
+        """
+        # Directories not listed yet played no part in earlier lookups.
+        is_stale = False
+        for directory in _directories(path):
+            entry = self._directories.get(directory)
+            if entry is not None and entry[0] != _mtime(directory):
+                del self._directories[directory]
+                is_stale = True
+        return is_stale
+
+    def _list(self, directory):
+        entry = self._directories.get(directory)
+        if entry is None:
+            entry = (_mtime(directory), _scan(directory))
+            self._directories[directory] = entry
+        return entry
+
+
+def _directories(path):
+    seen = set()
+    for directory in map(os.path.normcase, path.split(os.pathsep)):
+        if directory not in seen:
+            seen.add(directory)
+            yield directory
+
+
+def _mtime(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _scan(directory):
+    names = set()
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return frozenset()
+    with entries:
+        for entry in entries:
+            try:
+                if not entry.is_dir():
+                    names.add(os.path.normcase(entry.name))
+            except OSError:
+                pass
+    return frozenset(names)
+
+
+def _is_executable(filename):
+    return (os.path.exists(filename)
+            and os.access(filename, os.F_OK | os.X_OK)
+            and not os.path.isdir(filename))
+
+
+executable_index = ExecutableIndex()
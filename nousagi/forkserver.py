@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import atexit
+import json
+import os
+import select
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from six import string_types
+
+from .capture import CapturedOutput
+from .exceptions import ForkServerError, NousagiTestError
+from .process import (
+    KILL_GRACE_PERIOD, READ_SIZE, CommandResult, cancelled_result,
+    kill_process_group, running_processes, signal_process_group,
+    stream_writer
+)
+
+RUNNERS = ('subprocess', 'python-forkserver')
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(__file__), '_forkserver.py')
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class _ForkedChild(object):
+    """A child forked by a server, signalled through its process group."""
+    def __init__(self, pid):
+        self.pid = pid
+
+
+class _ForkServer(object):
+    def __init__(self, python, modules):
+        super(_ForkServer, self).__init__()
+        self.process = subprocess.Popen(
+            [python, SERVER_SCRIPT] + list(modules),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        self._buffer = b""
+
+    def send(self, request):
+        try:
+            self.process.stdin.write(
+                json.dumps(request).encode("utf-8") + b"\n"
+            )
+            self.process.stdin.flush()
+        except (IOError, OSError):
+            raise ForkServerError(
+                "Fork server exited with {0}".format(self.process.poll()))
+
+    def receive(self, timeout=None):
+        """Return the next reply, or ``None`` if none came in ``timeout``
+        seconds.
+
+        """
+        fd = self.process.stdout.fileno()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while b"\n" not in self._buffer:
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([fd], [], [], timeout)
+            if len(ready) == 0:
+                return None
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                raise ForkServerError(
+                    "Fork server exited with {0}".format(self.process.wait()))
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return json.loads(line.decode("utf-8"))
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
+
+
+class _ForkServerPool(object):
+    """Idle fork servers preloading the same modules, started as needed so
+    that each running command has its own.
+
+    """
+    def __init__(self, python, modules):
+        super(_ForkServerPool, self).__init__()
+        self.python = python
+        self.modules = modules
+        self._lock = threading.Lock()
+        self._idle = []
+        self._servers = []
+
+    def acquire(self):
+        with self._lock:
+            if len(self._idle) > 0:
+                return self._idle.pop()
+            server = _ForkServer(self.python, self.modules)
+            self._servers.append(server)
+            return server
+
+    def release(self, server):
+        with self._lock:
+            self._idle.append(server)
+
+    def discard(self, server):
+        with self._lock:
+            self._servers.remove(server)
+        server.close()
+
+    def close(self):
+        with self._lock:
+            servers, self._servers, self._idle = self._servers, [], []
+        for server in servers:
+            server.close()
+
+
+def _get_pool(python, modules):
+    key = (python, tuple(modules))
+    with _pools_lock:
+        if len(_pools) == 0:
+            atexit.register(_close_pools)
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = _ForkServerPool(python, modules)
+        return pool
+
+
+def _close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+
+class ForkServerRunner(object):
+    """Run commands as forks of a Python process that already imported the
+    CLI under test.
+
+    A server process imports the modules to preload once; each command is
+    then run by a fresh fork of the server, calling the entry point with
+    the command as ``sys.argv``, and the test's environment and working
+    directory. Output is captured through files rather than pipes, so it
+    reaches stream watchers only once the command exited.
+
+    Parameters
+    ----------
+    entry_point : str
+        The function run by each command, as ``module:function``.
+    preload : list, optional
+        Modules to import in the server, besides the one of the entry
+        point.
+    python : str, optional
+        The interpreter of the server, by default the current one.
+
+    """
+    def __init__(self, entry_point, preload=(), python=None):
+        super(ForkServerRunner, self).__init__()
+        if not hasattr(os, "fork"):
+            raise NousagiTestError(
+                "The python-forkserver runner needs os.fork")
+        self.entry_point = entry_point
+        module = entry_point.partition(":")[0]
+        self.modules = [module] + [
+            name for name in preload if name != module
+        ]
+        self.python = python or sys.executable
+
+    @classmethod
+    def from_json_dict(cls, data):
+        return cls(
+            entry_point=data["entry_point"], preload=data.get("preload", []),
+            python=data.get("python"),
+        )
+
+    def run(self, cmd, env=None, timeout=None, watcher=None):
+        if running_processes.is_cancelled:
+            return cancelled_result()
+        if isinstance(cmd, string_types):
+            cmd = shlex.split(cmd)
+        if env is None:
+            env = dict(os.environ)
+
+        pool = _get_pool(self.python, self.modules)
+        server = pool.acquire()
+        directory = tempfile.mkdtemp(prefix="nousagi-fork-")
+        filenames = [os.path.join(directory, name)
+                     for name in ("stdout", "stderr")]
+        try:
+            for filename in filenames:
+                open(filename, "wb").close()
+            try:
+                returncode, timed_out, cancelled = self._run(
+                    server, cmd, env, filenames, timeout
+                )
+            except Exception:
+                # The server may be waiting on a child, or gone.
+                pool.discard(server)
+                raise
+            pool.release(server)
+            output = CapturedOutput()
+            writers = [
+                stream_writer(output.write_stdout, watcher, 'stdout'),
+                stream_writer(output.write_stderr, watcher, 'stderr'),
+            ]
+            for filename, write in zip(filenames, writers):
+                with open(filename, "rb") as fh:
+                    for data in iter(lambda: fh.read(READ_SIZE), b""):
+                        write(data)
+            output.finish()
+        finally:
+            for filename in filenames:
+                os.remove(filename)
+            os.rmdir(directory)
+        return CommandResult(
+            output=output, returncode=returncode, timed_out=timed_out,
+            cancelled=cancelled,
+        )
+
+    def _run(self, server, cmd, env, filenames, timeout):
+        server.send({
+            "argv": cmd, "env": env, "cwd": os.getcwd(),
+            "entry_point": self.entry_point,
+            "stdout": filenames[0], "stderr": filenames[1],
+        })
+        child = _ForkedChild(server.receive()["pid"])
+        running_processes.add(child)
+        try:
+            reply = server.receive(timeout)
+            timed_out = reply is None
+            if timed_out:
+                signal_process_group(child, signal.SIGTERM)
+                reply = server.receive(KILL_GRACE_PERIOD)
+                if reply is None:
+                    kill_process_group(child)
+                    reply = server.receive()
+        except BaseException:
+            kill_process_group(child)
+            raise
+        finally:
+            cancelled = running_processes.remove(child)
+        return reply["returncode"], timed_out, cancelled
+
+
+def create_runner(data):
+    """Create the runner described by the ``runner`` config, or ``None``
+    for the default subprocess engine.
+
+    """
+    if data is None:
+        return None
+    if isinstance(data, string_types):
+        data = {"type": data}
+    kind = data.get("type", "subprocess")
+    if kind == "subprocess":
+        return None
+    elif kind == "python-forkserver":
+        return ForkServerRunner.from_json_dict(data)
+    msg = "Unknown runner {0!r} (must be one of {1})"
+    raise NousagiTestError(msg.format(kind, "|".join(RUNNERS)))
@@ -52,3 +52,15 @@ class IVarLoader(object):
             later stage after dependencies are resolved.
 
         """
+
+    def dependencies(self):
+        """The names of the vars which must be loaded before this one, and
+        given to ``load`` in ``variables``.
+
+        Returns
+        -------
+        names : iterable
+            The names of the vars this var depends on; empty by default.
+
+        """
+        return ()
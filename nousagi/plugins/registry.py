@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau.
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+
+class PluginRegistry(object):
+    """Process-wide, lazily loaded plugins of an entry point namespace.
+
+    A plugin is only imported the first time it is asked for by name, and
+    is then kept for the rest of the process.
+
+    Parameters
+    ----------
+    namespace : str
+        The entry point namespace of the plugins.
+
+    """
+    def __init__(self, namespace):
+        super(PluginRegistry, self).__init__()
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._plugins = {}
+
+    def get(self, name):
+        """Return the plugin called ``name``, or ``None`` if there is no
+        such plugin.
+
+        """
+        try:
+            return self._plugins[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._plugins:
+                self._plugins[name] = self._load(name)
+            return self._plugins[name]
+
+    def _load(self, name):
+        # stevedore is slow to import, and only needed on first use.
+        from stevedore.driver import DriverManager
+        from stevedore.exception import NoMatches
+
+        try:
+            manager = DriverManager(self.namespace, name)
+        except NoMatches:
+            return None
+        return manager.driver
+
+
+var_loaders = PluginRegistry('nousagi.var_loaders')
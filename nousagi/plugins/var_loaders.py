@@ -10,30 +10,66 @@ import os
 import os.path
 import subprocess
 
+from six import string_types
+
+from nousagi.command_cache import command_cache, command_key
 from nousagi.exceptions import InvalidVariable
+from nousagi.executable_index import executable_index
+from nousagi.process import command_from_json_dict, popen_kwargs
 
 from .i_var_loader import IVarLoader
 
 
 class CommandVarLoader(IVarLoader):
-    def __init__(self, name, command):
+    """Load a var from the output of a command.
+
+    With ``cache: session``, the output of identical commands is reused for
+    the whole session. With ``cache: {ttl: <seconds>}``, it is reused for
+    that long, across runs when a cache directory is configured. ``env``
+    lists environment variables, besides ``PATH``, whose values must match
+    for the output to be reused, e.g. ``cache: {ttl: 600, env: [HOME]}``.
+
+    """
+    def __init__(self, name, command, cache=None):
         super(CommandVarLoader, self).__init__()
         self.name = name
         self._command = command
+        self._cache = cache
         self._value = None
         self._is_loaded = False
 
     @classmethod
     def from_dict(cls, name, var_dict):
-        return cls(name=name, command=var_dict['command'])
+        cache = var_dict.get('cache')
+        if cache == 'session':
+            cache = {}
+        elif cache is not None and (
+                not isinstance(cache, dict)
+                or isinstance(cache.get('env', []), string_types)):
+            raise InvalidVariable(name, repr(var_dict))
+        return cls(
+            name=name, command=command_from_json_dict(var_dict, 'command'),
+            cache=cache,
+        )
 
     def load(self, filename, variables):
         if not self._is_loaded:
-            output = subprocess.check_output(self._command, shell=True)
+            if self._cache is None:
+                output = self._run()
+            else:
+                key = command_key(self._command, self._cache.get('env', ()))
+                output = command_cache.get(
+                    key, self._cache.get('ttl'), self._run
+                )
             self._value = output.rstrip()
             self._is_loaded = True
         return self._is_loaded
 
+    def _run(self):
+        return subprocess.check_output(
+            self._command, **popen_kwargs(self._command)
+        )
+
     @property
     def value(self):
         return self._value
@@ -97,17 +133,4 @@ class ExecutableVarLoader(IVarLoader):
 def _which(fn):
     """Simplified version of shutil.which
     """
-
-    def _access_check(fn):
-        return (os.path.exists(fn) and os.access(fn, os.F_OK | os.X_OK)
-                and not os.path.isdir(fn))
-    pathext = os.environ.get("PATHEXT", "").split(os.pathsep)
-    files = [fn + ext.lower() for ext in pathext]
-    path = os.environ.get("PATH", os.defpath).split(os.pathsep)
-    seen = set()
-    for dir in map(os.path.normcase, path):
-        if dir not in seen:
-            seen.add(dir)
-            for name in map(lambda f: os.path.join(dir, f), files):
-                if _access_check(name):
-                    return name
+    return executable_index.which(fn)
@@ -1,19 +1,20 @@
+import atexit
 import os.path
 import shutil
-import string
 import tempfile
+import threading
 
 from characteristic import Attribute, attributes
 
-from .exceptions import InvalidRegistrationVariable, NousagiTestError
+from .exceptions import (
+    InvalidRegistrationVariable, InvalidScope, NousagiTestError
+)
+from .slotted import Slotted
+from .templates import render_template, write_template_file
 
 
-@attributes([
-    Attribute("variables", instance_of=dict),
-    Attribute("environ", instance_of=dict),
-])
-class State(object):
-    pass
+class State(Slotted):
+    __slots__ = ("variables", "environ")
 
 
 @attributes([
@@ -71,7 +72,7 @@ class Env(Run):
         return cls(name=json_data["name"], value=json_data["value"])
 
     def run(self, state):
-        value = string.Template(self.value).substitute(**state.variables)
+        value = render_template(self.value, state.variables)
 
         return_state = self.ReturnState(env={self.name: value})
         return return_state
@@ -89,7 +90,8 @@ class MultiSteps(Run):
             pass
 
         def cleanup(self):
-            pass
+            for return_state in reversed(self.states):
+                return_state.cleanup()
 
     def run(self, state):
         return_states = []
@@ -106,6 +108,112 @@ class MultiSteps(Run):
             step.update(state, return_state.states[i])
 
 
+# How widely the setup of a pre-run definition is shared.
+SCOPES = ("test", "case", "file", "session")
+
+
+class SharedSteps(Run):
+    """Steps run once for every test of a scope, rather than before each
+    test.
+
+    The first test of the scope runs the steps; the variables they register
+    and the environment variables they set are then given to every test.
+    The steps are cleaned up when the last test of the scope is done, or
+    when the process exits.
+
+    Parameters
+    ----------
+    steps : MultiSteps
+        The steps to share.
+    scope : str
+        One of ``case``, ``file`` or ``session``.
+
+    """
+    @attributes(["shared"])
+    class ReturnState(object):
+        def cleanup(self):
+            self.shared.release()
+
+    def __init__(self, steps, scope):
+        super(SharedSteps, self).__init__()
+        if scope not in SCOPES[1:]:
+            raise InvalidScope(
+                "Invalid scope {0!r} (must be one of {1})".format(
+                    scope, "|".join(SCOPES)))
+        self.steps = steps
+        self.scope = scope
+        self._lock = threading.Lock()
+        self._users = 0
+        self._return_state = None
+        self._changes = None
+        self._error = None
+        self._is_registered = False
+
+    def for_case(self):
+        """The steps to use for the tests of a new case."""
+        if self.scope == "case":
+            return SharedSteps(self.steps, self.scope)
+        return self
+
+    def add_users(self, count):
+        with self._lock:
+            self._users += count
+
+    def run(self, state):
+        with self._lock:
+            if self._changes is None and self._error is None:
+                self._setup(state)
+            if self._error is not None:
+                raise self._error
+            variables, environ = self._changes
+        state.variables.update(variables)
+        state.environ.update(environ)
+        return self.ReturnState(shared=self)
+
+    def update(self, state, return_state):
+        pass
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            if self._users <= 0:
+                self._cleanup()
+
+    def cleanup(self):
+        with self._lock:
+            self._cleanup()
+
+    def _setup(self, state):
+        shared_state = State(
+            variables=dict(state.variables), environ=dict(state.environ)
+        )
+        try:
+            self._return_state = self.steps.run(shared_state)
+        except Exception as e:
+            self._error = e
+            return
+        self._changes = (
+            _changed_items(state.variables, shared_state.variables),
+            _changed_items(state.environ, shared_state.environ),
+        )
+        if not self._is_registered:
+            atexit.register(self.cleanup)
+            self._is_registered = True
+
+    def _cleanup(self):
+        return_state, self._return_state = self._return_state, None
+        self._changes = None
+        if return_state is not None:
+            return_state.cleanup()
+
+
+def _changed_items(before, after):
+    return dict(
+        (key, value) for key, value in after.items()
+        if key not in before or before[key] != value
+    )
+
+
 class Mkdtemp(object):
     @attributes(["path"])
     class ReturnState(object):
@@ -162,13 +270,9 @@ class WriteFileFromTemplate(object):
         return cls(target=json_data["target"], template=source)
 
     def __call__(self, state):
-        target = string.Template(self.target).substitute(**state.variables)
-        source = string.Template(self.template).substitute(**state.variables)
-
-        with open(source, "rt") as fp:
-            template = string.Template(fp.read())
-        with open(target, "wt") as fp:
-            fp.write(template.substitute(**state.variables))
+        target = render_template(self.target, state.variables)
+        source = render_template(self.template, state.variables)
+        write_template_file(source, target, state.variables)
 
         return_state = self.ReturnState()
         return return_state
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import os
+import selectors
+import shlex
+import signal
+import subprocess
+import threading
+import time
+
+from characteristic import Attribute, attributes
+from six import string_types
+
+from .capture import CapturedOutput
+from .slotted import check_type
+from .templates import prerender_template, render_template
+
+
+ENGINES = ('subprocess', 'asyncio')
+
+# Size of the chunks read from the pipes of a running command.
+READ_SIZE = 64 * 1024
+
+# Seconds a timed out command gets to exit after SIGTERM before SIGKILL.
+KILL_GRACE_PERIOD = 2.0
+
+# Why tests are skipped once commands are cancelled.
+CANCELLED_MESSAGE = 'Cancelled after a failure (fail-fast)'
+
+if os.name == 'posix':
+    # The child leads its own session, so its whole process tree can be
+    # signalled at once through the process group.
+    NEW_SESSION_KWARGS = {'start_new_session': True}
+else:  # pragma: no cover
+    NEW_SESSION_KWARGS = {
+        'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP
+    }
+
+
+@attributes([
+    Attribute("output", instance_of=CapturedOutput),
+    "returncode",
+    Attribute("timed_out", default_value=False),
+    Attribute("stopped", default_value=False),
+    Attribute("cancelled", default_value=False),
+])
+class CommandResult(object):
+    """Captured outcome of a command run by an engine.
+
+    ``stopped`` is true when the command was stopped early because its
+    stream watcher asked for it, and ``cancelled`` when it was killed, or
+    never started, because every command was cancelled.
+
+    """
+    @property
+    def stdout(self):
+        return self.output.stdout
+
+    @property
+    def stderr(self):
+        return self.output.stderr
+
+
+def command_from_json_dict(data, key, shell=True):
+    """Return the command described by ``data``.
+
+    The command is either a string run through the shell, from ``key``, or
+    an argument list executed directly, from ``exec`` (a list, or a string
+    parsed with ``shlex``). ``shell: false`` also runs ``key`` directly.
+
+    """
+    if "exec" in data:
+        argv = data["exec"]
+        if isinstance(argv, string_types):
+            argv = shlex.split(argv)
+        return list(argv)
+    command = data[key]
+    check_type(key, command, string_types)
+    if data.get("shell", shell):
+        return command
+    return shlex.split(command)
+
+
+def render_command(command, variables):
+    if isinstance(command, string_types):
+        return render_template(command, variables)
+    # Each argument is rendered on its own, so values with spaces are never
+    # split.
+    return [render_template(arg, variables) for arg in command]
+
+
+def prerender_command(command, variables):
+    if isinstance(command, string_types):
+        command = [command]
+    for arg in command:
+        prerender_template(arg, variables)
+
+
+def popen_kwargs(cmd):
+    """Run string commands through the shell, and argument lists directly.
+
+    Without the intermediate shell, ``subprocess`` spawns the target itself,
+    with ``vfork`` where available.
+
+    """
+    return {'shell': isinstance(cmd, string_types)}
+
+
+def signal_process_group(process, sig):
+    """Send ``sig`` to every process in the group led by ``process``."""
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, sig)
+        elif sig == signal.SIGTERM:  # pragma: no cover
+            process.terminate()
+        else:  # pragma: no cover
+            process.kill()
+    except OSError:
+        # The whole group already exited.
+        pass
+
+
+def kill_process_group(process):
+    """Kill every process in the group led by ``process``."""
+    signal_process_group(process, getattr(signal, 'SIGKILL', signal.SIGTERM))
+
+
+class RunningProcesses(object):
+    """The child processes of running commands, so that they can all be
+    killed at once.
+
+    Once cancelled, processes added are killed right away.
+
+    """
+    def __init__(self):
+        super(RunningProcesses, self).__init__()
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._killed = set()
+        self.is_cancelled = False
+
+    def add(self, process):
+        with self._lock:
+            if self.is_cancelled:
+                self._kill(process)
+            else:
+                self._processes.add(process)
+
+    def remove(self, process):
+        """Forget ``process``, and return whether it was killed."""
+        with self._lock:
+            self._processes.discard(process)
+            if process in self._killed:
+                self._killed.remove(process)
+                return True
+            return False
+
+    def cancel(self):
+        with self._lock:
+            self.is_cancelled = True
+            for process in self._processes:
+                self._kill(process)
+            self._processes.clear()
+
+    def _kill(self, process):
+        kill_process_group(process)
+        self._killed.add(process)
+
+
+running_processes = RunningProcesses()
+
+
+def cancel_commands():
+    """Kill the process group of every running command, and every command
+    started from now on.
+
+    """
+    running_processes.cancel()
+
+
+def are_commands_cancelled():
+    return running_processes.is_cancelled
+
+
+def cancelled_result():
+    """The result of a command not started because commands were
+    cancelled.
+
+    """
+    output = CapturedOutput()
+    output.finish()
+    return CommandResult(output=output, returncode=None, cancelled=True)
+
+
+class SubprocessEngine(object):
+    """Run each command with a blocking ``subprocess.Popen``."""
+    def run(self, cmd, env=None, timeout=None, watcher=None):
+        p = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            stdin=subprocess.PIPE, env=env, **dict(
+                NEW_SESSION_KWARGS, **popen_kwargs(cmd)
+            )
+        )
+        p.stdin.close()
+        running_processes.add(p)
+        output = CapturedOutput()
+        pipes = [
+            (p.stdout, stream_writer(output.write_stdout, watcher, 'stdout')),
+            (p.stderr, stream_writer(output.write_stderr, watcher, 'stderr')),
+        ]
+        try:
+            is_done = _pump(p, pipes, _deadline(timeout), watcher)
+            if not is_done:
+                self._kill(p, pipes)
+        except BaseException:
+            # The child leads its own session, so an interrupt from the
+            # terminal never reaches it: kill it rather than orphan it.
+            kill_process_group(p)
+            p.wait()
+            raise
+        finally:
+            cancelled = running_processes.remove(p)
+        output.finish()
+        stopped = not is_done and is_stop_requested(watcher)
+        return CommandResult(
+            output=output, returncode=p.returncode,
+            timed_out=not (is_done or stopped), stopped=stopped,
+            cancelled=cancelled,
+        )
+
+    def _kill(self, p, pipes):
+        signal_process_group(p, signal.SIGTERM)
+        if not _pump(p, pipes, _deadline(KILL_GRACE_PERIOD)):
+            kill_process_group(p)
+            _pump(p, pipes, None)
+
+
+def stream_writer(write, watcher, stream):
+    """Return a function writing chunks of ``stream`` with ``write``, and
+    feeding them to ``watcher`` if any.
+
+    """
+    if watcher is None:
+        return write
+    feed = getattr(watcher, 'feed_{0}'.format(stream))
+
+    def write_and_feed(data):
+        write(data)
+        feed(data)
+    return write_and_feed
+
+
+def is_stop_requested(watcher):
+    return watcher is not None and watcher.should_stop
+
+
+def _deadline(timeout):
+    if timeout is None:
+        return None
+    return time.monotonic() + timeout
+
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    return max(0, deadline - time.monotonic())
+
+
+def _pump(p, pipes, deadline, watcher=None):
+    """Copy the ``(pipe, write)`` pairs of ``p`` until it exits.
+
+    Returns ``False`` if ``deadline`` passed first, or if ``watcher`` asked
+    for the command to be stopped.
+
+    """
+    pipes = [(pipe, write) for pipe, write in pipes if not pipe.closed]
+    if os.name == 'posix':
+        is_done = _pump_with_selector(pipes, deadline, watcher)
+    else:  # pragma: no cover
+        is_done = _pump_with_threads(pipes, deadline, watcher)
+    if not is_done:
+        return False
+    try:
+        p.wait(timeout=_remaining(deadline))
+    except subprocess.TimeoutExpired:
+        return False
+    return True
+
+
+def _pump_with_selector(pipes, deadline, watcher):
+    with selectors.DefaultSelector() as selector:
+        for pipe, write in pipes:
+            selector.register(pipe, selectors.EVENT_READ, write)
+        while len(selector.get_map()) > 0:
+            remaining = _remaining(deadline)
+            if remaining == 0:
+                return False
+            for key, _ in selector.select(remaining):
+                data = os.read(key.fd, READ_SIZE)
+                if data:
+                    key.data(data)
+                else:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+            if is_stop_requested(watcher):
+                return False
+    return True
+
+
+def _pump_with_threads(pipes, deadline, watcher):  # pragma: no cover
+    # Pipes cannot be selected on windows.
+    def copy(pipe, write):
+        for data in iter(lambda: pipe.read(READ_SIZE), b""):
+            write(data)
+        pipe.close()
+
+    threads = [
+        threading.Thread(target=copy, args=pipe_and_write)
+        for pipe_and_write in pipes
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        remaining = _remaining(deadline)
+        if remaining == 0 or is_stop_requested(watcher):
+            return False
+        for thread in threads:
+            thread.join(0.1 if remaining is None else min(0.1, remaining))
+    return True
+
+
+def create_engine(name, max_processes=None):
+    if name == 'asyncio':
+        # Imported lazily, not to pay for asyncio with the default engine.
+        from ._asyncio_engine import AsyncioEngine
+        return AsyncioEngine(max_processes)
+    elif name == 'subprocess':
+        return SubprocessEngine()
+    msg = "Unknown engine {0!r} (must be one of {1})"
+    raise ValueError(msg.format(name, "|".join(ENGINES)))
+
+
+_engine = SubprocessEngine()
+
+
+def get_engine():
+    return _engine
+
+
+def set_engine(engine):
+    global _engine
+    _engine = engine
+
+
+def run_command(cmd, env=None, timeout=None, watcher=None):
+    """Run ``cmd`` with the process-wide engine.
+
+    ``cmd`` is run through the shell if it is a string, and executed
+    directly if it is a list of arguments.
+
+    If the command is still running after ``timeout`` seconds, its whole
+    process group is terminated, then killed, and the returned result is
+    flagged as ``timed_out``. The same happens, flagged as ``stopped``, as
+    soon as the optional ``StreamWatcher`` fed with its output asks for it.
+
+    Once commands are cancelled, ``cmd`` is not started, and the returned
+    result is flagged as ``cancelled``.
+
+    """
+    if running_processes.is_cancelled:
+        return cancelled_result()
+    return _engine.run(cmd, env=env, timeout=timeout, watcher=watcher)
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import atexit
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+
+# How much of the output of a test, and of its failure message, is kept in
+# its record.
+MAX_RECORDED_OUTPUT = 2048
+
+STATUSES = ("success", "failure", "error", "skipped")
+
+# Characters XML 1.0 cannot hold, even escaped.
+_INVALID_XML_CHARACTERS = (
+    "[^\t\n\r\u0020-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]"
+)
+
+
+def _truncate(text):
+    if len(text) > MAX_RECORDED_OUTPUT:
+        return text[:MAX_RECORDED_OUTPUT] + "..."
+    return text
+
+
+def _head(output):
+    head = output.read(MAX_RECORDED_OUTPUT).decode("utf-8", "replace")
+    if len(output) > MAX_RECORDED_OUTPUT:
+        head += "..."
+    return head
+
+
+class _NullRecording(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_RECORDING = _NullRecording()
+
+
+class _Recording(object):
+    def __init__(self, stream, test, case):
+        self._stream = stream
+        cls = type(case)
+        filename = getattr(cls, "nousagi_filename", None)
+        if filename is not None:
+            filename = os.path.relpath(filename).replace(os.sep, "/")
+        self.record = {
+            "file": filename,
+            "case": getattr(cls, "nousagi_name", None),
+            "test": test.name,
+            "exit_code": None,
+            "command_s": 0.0,
+            "stdout": "",
+            "stderr": "",
+        }
+        self._start = None
+
+    def __enter__(self):
+        self._stream._local.recording = self
+        self.record["started"] = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        record = self.record
+        record["duration_s"] = time.perf_counter() - self._start
+        if exc_type is None:
+            record["status"] = "success"
+        else:
+            if issubclass(exc_type, unittest.SkipTest):
+                record["status"] = "skipped"
+            elif issubclass(exc_type, AssertionError):
+                record["status"] = "failure"
+            else:
+                record["status"] = "error"
+            record["message"] = _truncate(
+                "{0}: {1}".format(exc_type.__name__, exc_value))
+        self._stream._local.recording = None
+        self._stream.write(record)
+        return False
+
+    def add_command(self, result, duration):
+        record = self.record
+        record["exit_code"] = result.returncode
+        record["command_s"] += duration
+        record["stdout"] = _head(result.stdout)
+        record["stderr"] = _head(result.stderr)
+
+
+class ResultStream(object):
+    """Write the result of every test to a JSON Lines file.
+
+    Each record is written and flushed as soon as its test is done, so the
+    file can be followed while the run goes on, and holds the results of a
+    run that crashed. Records hold the file, case and test names, the
+    status, the exit code, output and time spent in commands of the test,
+    and its total duration. A test running several commands, e.g. a
+    scenario, records the exit code and output of the last one.
+
+    Streaming is disabled until ``start`` is called. A JUnit XML report may
+    also be built from the records, when the process exits.
+
+    """
+    def __init__(self):
+        super(ResultStream, self).__init__()
+        self.filename = None
+        self.junit_filename = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._fh = None
+        self._is_temporary = False
+
+    @property
+    def is_enabled(self):
+        return self._fh is not None
+
+    def start(self, filename=None, junit_filename=None):
+        """Write records to ``filename`` from now on, and the JUnit XML
+        report to ``junit_filename`` at exit, if given. Without
+        ``filename``, records go to a temporary file.
+
+        """
+        if self._fh is not None:
+            return
+        if filename is None:
+            directory = os.path.dirname(os.path.abspath(junit_filename))
+            fd, filename = tempfile.mkstemp(
+                dir=directory, prefix=".nousagi-", suffix=".jsonl"
+            )
+            os.close(fd)
+            self._is_temporary = True
+        self.filename = filename
+        self.junit_filename = junit_filename
+        self._fh = io.open(filename, "wt", encoding="utf-8")
+        atexit.register(self.finish)
+
+    def recording(self, test, case):
+        """A context manager recording the outcome of ``test``, run with
+        ``case``, when its block exits.
+
+        """
+        if self._fh is None:
+            return _NULL_RECORDING
+        return _Recording(self, test, case)
+
+    def add_command(self, result, duration):
+        """Record ``result``, of a command that took ``duration`` seconds,
+        in the test running in this thread.
+
+        """
+        recording = getattr(self._local, "recording", None)
+        if recording is not None:
+            recording.add_command(result, duration)
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True)
+        with self._lock:
+            if self._fh is not None:
+                self._fh.write(line + "\n")
+                self._fh.flush()
+
+    def finish(self):
+        with self._lock:
+            fh, self._fh = self._fh, None
+        if fh is None:
+            return
+        fh.close()
+        try:
+            if self.junit_filename is not None:
+                write_junit_xml(self.filename, self.junit_filename)
+        finally:
+            if self._is_temporary:
+                os.remove(self.filename)
+
+
+def _iter_records(filename):
+    with io.open(filename, "rt", encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # The last line of a crashed run may be cut short.
+                continue
+
+
+def write_junit_xml(results_filename, junit_filename):
+    """Write the JUnit XML report of the records in ``results_filename``.
+
+    Records are read twice, for the totals of the report, then its test
+    cases, so that the memory used does not grow with the number of
+    tests.
+
+    """
+    # Only needed at the end of the run, and slow to import: saxutils
+    # imports urllib and email.
+    from xml.sax.saxutils import escape, quoteattr
+    invalid = re.compile(_INVALID_XML_CHARACTERS)
+
+    def text(value):
+        return escape(invalid.sub("\ufffd", value))
+
+    def attribute(value):
+        return quoteattr(invalid.sub("\ufffd", value))
+
+    counts = dict((status, 0) for status in STATUSES)
+    total_time = 0.0
+    for record in _iter_records(results_filename):
+        counts[record["status"]] += 1
+        total_time += record["duration_s"]
+
+    with io.open(junit_filename, "wt", encoding="utf-8") as fh:
+        fh.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        fh.write(
+            '<testsuite name="nousagi" tests="{0}" failures="{1}" '
+            'errors="{2}" skipped="{3}" time="{4:.3f}">\n'.format(
+                sum(counts.values()), counts["failure"], counts["error"],
+                counts["skipped"], total_time)
+        )
+        for record in _iter_records(results_filename):
+            fh.write(_junit_test_case(record, text, attribute))
+        fh.write("</testsuite>\n")
+
+
+def _junit_test_case(record, text, attribute):
+    class_name = "{0}::{1}".format(record["file"], record["case"])
+    lines = ['  <testcase classname={0} name={1} time="{2:.3f}">'.format(
+        attribute(class_name), attribute(record["test"]),
+        record["duration_s"])]
+    status = record["status"]
+    message = record.get("message", "")
+    if status == "skipped":
+        lines.append("    <skipped message={0}/>".format(
+            attribute(message)))
+    elif status in ("failure", "error"):
+        lines.append("    <{0} message={1}>{2}</{0}>".format(
+            status, attribute(message.splitlines()[0] if message else ""),
+            text(message)))
+    for stream in ("stdout", "stderr"):
+        if record[stream]:
+            lines.append("    <system-{0}>{1}</system-{0}>".format(
+                stream[3:], text(record[stream])))
+    lines.append("  </testcase>")
+    return "\n".join(lines) + "\n"
+
+
+result_stream = ResultStream()
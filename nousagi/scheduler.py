@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import atexit
+import logging
+import threading
+import time
+import unittest
+
+from .durations import format_prediction
+from .process import CANCELLED_MESSAGE, are_commands_cancelled, cancel_commands
+from .results import result_stream
+
+logger = logging.getLogger(__name__)
+
+# Attribute of generated test methods holding the test they run.
+TEST_ATTRIBUTE = 'nousagi_test'
+
+# Attribute of generated test methods holding the key of their duration in
+# the duration history.
+DURATION_KEY_ATTRIBUTE = 'nousagi_duration_key'
+
+
+def iter_generated_tests(suite):
+    """Yield ``(test, case)`` for every generated test of ``suite``, in
+    order.
+
+    """
+    for case in suite:
+        if isinstance(case, unittest.TestCase):
+            method = getattr(case, case._testMethodName)
+            test = getattr(method, TEST_ATTRIBUTE, None)
+            if test is not None:
+                yield test, case
+        else:
+            for test_and_case in iter_generated_tests(case):
+                yield test_and_case
+
+
+def duration_key(case):
+    method = getattr(case, case._testMethodName)
+    return getattr(method, DURATION_KEY_ATTRIBUTE, None)
+
+
+def _run_timed(test, case, history):
+    key = duration_key(case)
+    if history is None or key is None:
+        return test.run(case)
+    # Only tests running to completion are recorded: failing, skipped and
+    # cancelled tests stop early, and would shorten their duration.
+    start = time.perf_counter()
+    result = test.run(case)
+    history.record(key, time.perf_counter() - start)
+    return result
+
+
+def _run_test(test, case, history, fail_fast):
+    """Run ``test``, cancelling every command if it fails and either
+    ``fail_fast`` is true, or the test is itself marked fail-fast. The
+    outcome is written to the result stream, if enabled.
+
+    """
+    with result_stream.recording(test, case):
+        if are_commands_cancelled():
+            case.skipTest(CANCELLED_MESSAGE)
+        try:
+            return _run_timed(test, case, history)
+        except unittest.SkipTest:
+            raise
+        except Exception:
+            if fail_fast or test.fail_fast:
+                logger.debug('Cancelling every command after %r failed',
+                             test.name)
+                cancel_commands()
+            raise
+
+
+class SerialScheduler(object):
+    """Run each generated test inline, when ``haas`` calls its test method.
+
+    Parameters
+    ----------
+    history : DurationHistory, optional
+        If given, where the duration of each test is recorded.
+    fail_fast : bool, optional
+        If true, the first test failing cancels every other test.
+
+    """
+    jobs = 1
+
+    def __init__(self, history=None, fail_fast=False):
+        super(SerialScheduler, self).__init__()
+        self._history = history
+        self._fail_fast = fail_fast
+        self._keys = []
+
+    def add_suite(self, suite):
+        # Keys are only needed to predict the run from the history.
+        if self._history is not None:
+            self._keys.extend(
+                duration_key(case) for _, case in iter_generated_tests(suite)
+            )
+
+    def run(self, test, case):
+        return _run_test(test, case, self._history, self._fail_fast)
+
+    def format_prediction(self):
+        return _format_prediction(self._history, self._keys, self.jobs)
+
+
+class ParallelScheduler(object):
+    """Run generated tests ahead of time in a pool of worker threads.
+
+    Tests are registered in suite order once discovery is done. The first
+    time ``haas`` runs one of them, every registered test is queued on the
+    pool; each test method then waits for its own job and re-raises its
+    outcome, so results still reach ``haas`` in file order.
+
+    With a duration history, tests are queued longest first, so that a long
+    test does not start last and delay the end of the run.
+
+    Workers are threads rather than processes: the time is spent waiting on
+    child processes, and generated ``TestCase`` classes cannot be pickled.
+
+    The pool is closed when the process exits. If ``haas`` stopped before
+    every queued test ran, e.g. with ``--failfast``, the commands still
+    running are killed first, and the tests left are dropped.
+
+    Parameters
+    ----------
+    jobs : int
+        The number of tests to run concurrently.
+    history : DurationHistory, optional
+        If given, where the duration of each test is recorded and predicted
+        from.
+    fail_fast : bool, optional
+        If true, the first test failing cancels every other test: queued
+        tests are skipped, and running commands are killed.
+
+    """
+    def __init__(self, jobs, history=None, fail_fast=False):
+        super(ParallelScheduler, self).__init__()
+        self.jobs = jobs
+        self._history = history
+        self._fail_fast = fail_fast
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = []
+        self._results = {}
+        self._keys = []
+
+    def add_suite(self, suite):
+        with self._lock:
+            for test, case in iter_generated_tests(suite):
+                self._pending.append((test, type(case), case._testMethodName))
+                if self._history is not None:
+                    self._keys.append(duration_key(case))
+
+    def format_prediction(self):
+        return _format_prediction(self._history, self._keys, self.jobs)
+
+    def run(self, test, case):
+        with self._lock:
+            if id(test) not in self._results:
+                self._start()
+            result = self._results.get(id(test))
+        if result is None:
+            logger.debug('Running unregistered test %r inline', test.name)
+            return test.run(case)
+        try:
+            return result.get()
+        finally:
+            # A job interrupted while awaited is still running: it is kept,
+            # for close to kill its commands.
+            if result.ready():
+                with self._lock:
+                    self._results.pop(id(test), None)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            results, self._results = self._results, {}
+            self._pending = []
+        if pool is None:
+            return
+        if any(not result.ready() for result in results.values()):
+            logger.debug('Killing the commands of unfinished tests')
+            cancel_commands()
+        pool.terminate()
+        pool.join()
+
+    def _start(self):
+        if self._pool is None:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(self.jobs)
+            atexit.register(self.close)
+        pending = self._pending
+        if self._history is not None and len(pending) > 0:
+            # Longest processing time first; sorted is stable, so tests
+            # expected to take as long keep their order. Only tests pending
+            # since the last start are left at the end of the keys.
+            estimates = self._history.estimates(self._keys[-len(pending):])
+            order = sorted(
+                range(len(pending)), key=lambda index: -estimates[index]
+            )
+            pending = [pending[index] for index in order]
+        for test, case_cls, method_name in pending:
+            self._results[id(test)] = self._pool.apply_async(
+                _run_job,
+                (test, case_cls, method_name, self._history, self._fail_fast)
+            )
+        self._pending = []
+
+
+def _run_job(test, case_cls, method_name, history, fail_fast):
+    # The assertions only need a TestCase to call assert* methods on, so a
+    # fresh instance of the generated class stands in for haas' own.
+    return _run_test(test, case_cls(method_name), history, fail_fast)
+
+
+def _format_prediction(history, keys, jobs):
+    """Describe the predicted duration of the run, from the duration
+    history.
+
+    """
+    estimates = history.estimates(keys)
+    return format_prediction(list(zip(keys, estimates)), jobs)
+
+
+def create_scheduler(jobs, history=None, fail_fast=False):
+    if jobs > 1:
+        return ParallelScheduler(jobs, history, fail_fast)
+    return SerialScheduler(history, fail_fast)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+from fnmatch import fnmatchcase
+
+# Separates the file, case and test names in a test path, as in
+# ``tests/test_cli.yml::case::test``.
+PATH_SEPARATOR = "::"
+
+
+def split_test_path(path):
+    """Split ``file[::case[::test]]`` into the file, and the case and test
+    names, ``None`` when not given.
+
+    """
+    parts = path.split(PATH_SEPARATOR, 2)
+    parts += [None] * (3 - len(parts))
+    return tuple(parts)
+
+
+def _spec_tags(spec):
+    tags = spec.get("tags", [])
+    if not isinstance(tags, list):
+        tags = [tags]
+    return tags
+
+
+class TestSelection(object):
+    """Select the tests to load, from the YAML data of their case and their
+    own.
+
+    Parameters
+    ----------
+    names : list, optional
+        If given, only tests whose ``case:test`` name matches one of these
+        shell-style patterns are selected.
+    tags : list, optional
+        If given, only tests with one of these tags, or in a case with one
+        of them, are selected.
+    case_name : str, optional
+        If given, only the tests of the case with this exact name are
+        selected.
+    test_name : str, optional
+        If given, only the test with this exact name is selected.
+
+    """
+    def __init__(self, names=(), tags=(), case_name=None, test_name=None):
+        super(TestSelection, self).__init__()
+        self.names = list(names)
+        self.tags = set(tags)
+        self.case_name = case_name
+        self.test_name = test_name
+
+    @property
+    def is_empty(self):
+        """Whether every test is selected."""
+        return (
+            len(self.names) == 0 and len(self.tags) == 0
+            and self.case_name is None and self.test_name is None
+        )
+
+    def within(self, case_name, test_name=None):
+        """The tests of this selection that are also in the given case, or
+        are the given test.
+
+        """
+        return type(self)(self.names, self.tags, case_name, test_name)
+
+    def accepts_case(self, case):
+        """Whether any test of ``case`` is selected."""
+        if self.case_name is not None and case["name"] != self.case_name:
+            return False
+        return any(
+            self.accepts(case, spec)
+            for spec in case.get("tests", []) + case.get("scenarios", [])
+        )
+
+    def accepts(self, case, spec):
+        """Whether the test of data ``spec``, in ``case``, is selected."""
+        if self.case_name is not None and case["name"] != self.case_name:
+            return False
+        if self.test_name is not None and spec["name"] != self.test_name:
+            return False
+        if len(self.names) > 0:
+            name = "{0}:{1}".format(case["name"], spec["name"])
+            if not any(fnmatchcase(name, pattern) for pattern in self.names):
+                return False
+        if len(self.tags) > 0:
+            tags = _spec_tags(case) + _spec_tags(spec)
+            if self.tags.isdisjoint(tags):
+                return False
+        return True
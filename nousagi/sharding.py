@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import heapq
+import json
+import os
+
+from .durations import case_durations
+
+
+def case_key(filename, case_name):
+    """The name of a case, identical on every machine running the suite
+    from the same directory.
+
+    """
+    path = os.path.relpath(filename).replace(os.sep, "/")
+    return "{0}::{1}".format(path, case_name)
+
+
+def parse_shard(text):
+    """Parse ``K/N`` into ``(K, N)``, for the K-th of N shards."""
+    try:
+        index, count = [int(part) for part in text.split("/")]
+    except ValueError:
+        raise ValueError("Invalid shard {0!r}, expected K/N".format(text))
+    if not 1 <= index <= count:
+        raise ValueError(
+            "Invalid shard {0!r}, expected 1 <= K <= N".format(text))
+    return index, count
+
+
+class Shard(object):
+    """Select the cases of one of several shards of the suite.
+
+    Cases are spread over shards by a hash of their key. When the duration
+    of cases is known, those cases are instead spread so that every shard
+    gets about the same total duration, longest cases first.
+
+    Parameters
+    ----------
+    index : int
+        The shard to select, from 1 to ``count``.
+    count : int
+        The number of shards.
+    durations : dict, optional
+        The duration in seconds of cases, by case key.
+
+    """
+    def __init__(self, index, count, durations=None):
+        super(Shard, self).__init__()
+        self.index = index
+        self.count = count
+        self._assigned = _balance(durations or {}, count)
+
+    @classmethod
+    def from_args(cls, shard, durations_filename=None):
+        index, count = parse_shard(shard)
+        durations = None
+        if durations_filename is not None:
+            durations = load_durations(durations_filename)
+        return cls(index, count, durations)
+
+    def __call__(self, filename, case):
+        """Whether ``case``, from the file ``filename``, is in this
+        shard.
+
+        """
+        return self.contains(case_key(filename, case['name']))
+
+    def contains(self, key):
+        shard = self._assigned.get(key)
+        if shard is None:
+            digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+            shard = int(digest, 16) % self.count
+        return shard == self.index - 1
+
+
+def load_durations(filename):
+    """Load the durations of cases, from either a duration history, or a
+    JSON object mapping case keys to seconds.
+
+    """
+    with open(filename, "rt") as fh:
+        return case_durations(json.load(fh))
+
+
+def _balance(durations, count):
+    # Longest processing time first: each case goes to the shard with the
+    # least total duration so far. Ties are broken by key and shard number,
+    # so every machine computes the same assignment.
+    shards = [(0.0, shard) for shard in range(count)]
+    assigned = {}
+    for key in sorted(durations, key=lambda key: (-durations[key], key)):
+        total, shard = heapq.heappop(shards)
+        assigned[key] = shard
+        heapq.heappush(shards, (total + durations[key], shard))
+    return assigned
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+# The attribute names of each Slotted subclass, in definition order.
+_attribute_names = {}
+
+
+def _names(cls):
+    names = _attribute_names.get(cls)
+    if names is None:
+        names = _attribute_names[cls] = tuple(
+            name
+            for klass in reversed(cls.__mro__)
+            for name in klass.__dict__.get("__slots__", ())
+        )
+    return names
+
+
+def check_type(name, value, types):
+    """Raise a ``TypeError`` unless ``value``, of the attribute ``name``, is
+    an instance of ``types``.
+
+    """
+    if not isinstance(value, types):
+        raise TypeError(
+            "{0!r} must be a {1!r} (got {2!r} that is a {3!r}).".format(
+                name, types, value, type(value))
+        )
+
+
+class Slotted(object):
+    """Base of the compact classes holding the tests of a file.
+
+    Attributes are declared in ``__slots__``, so that instances have no
+    ``__dict__``, and set from keyword arguments, or from ``_defaults``
+    when omitted. Nothing is validated on construction: the values given
+    by the YAML data are checked once, with ``check_type``, when loading
+    it. Instances of the same class with equal attributes are equal, and
+    hash the same, like the ``characteristic`` classes they replace.
+
+    """
+    __slots__ = ()
+
+    _defaults = {}
+
+    def __init__(self, **kwargs):
+        for name in _names(type(self)):
+            if name in kwargs:
+                value = kwargs.pop(name)
+            elif name in self._defaults:
+                value = self._defaults[name]
+            else:
+                raise TypeError("Missing keyword value for {0!r}.".format(
+                    name))
+            setattr(self, name, value)
+        if len(kwargs) > 0:
+            raise TypeError("Unexpected keyword values {0}.".format(
+                ", ".join(sorted(kwargs))))
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in _names(type(self)))
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return "<{0}({1})>".format(type(self).__name__, ", ".join(
+            "{0}={1!r}".format(name, value)
+            for name, value in zip(_names(type(self)), self._values())
+        ))
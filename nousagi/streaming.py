@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+# Longest unterminated line kept around for ``until`` matching.
+MAX_PENDING_LINE = 64 * 1024
+
+
+class PrefixMatcher(object):
+    """Fail as soon as stdout diverges from ``prefix``.
+
+    stdout comes first in the joined output, so a mismatch there is final
+    and the command can be stopped right away.
+
+    """
+    def __init__(self, prefix):
+        super(PrefixMatcher, self).__init__()
+        self.prefix = prefix
+        self.failure = None
+        self._offset = 0
+
+    @property
+    def should_stop(self):
+        return self.failure is not None
+
+    def feed_stdout(self, data):
+        if self.failure is not None or self._offset >= len(self.prefix):
+            return
+        expected = self.prefix[self._offset:self._offset + len(data)]
+        if data[:len(expected)] != expected:
+            msg = "Output does not start with {0!r}"
+            self.failure = msg.format(self.prefix)
+        self._offset += len(expected)
+
+    def feed_stderr(self, data):
+        pass
+
+
+class UntilMatcher(object):
+    """Stop the command once a line of its output matches ``regex``.
+
+    The test fails if the command exits without printing such a line.
+
+    """
+    def __init__(self, regex):
+        super(UntilMatcher, self).__init__()
+        self.regex = regex
+        self.is_matched = False
+        self._pending = {"stdout": b"", "stderr": b""}
+
+    @property
+    def should_stop(self):
+        return self.is_matched
+
+    @property
+    def failure(self):
+        if self.is_matched:
+            return None
+        msg = "Output never matched {0!r}"
+        return msg.format(self.regex.pattern)
+
+    def feed_stdout(self, data):
+        self._feed("stdout", data)
+
+    def feed_stderr(self, data):
+        self._feed("stderr", data)
+
+    def _feed(self, stream, data):
+        if self.is_matched:
+            return
+        lines = (self._pending[stream] + data).split(b"\n")
+        # The last, unterminated line is matched as well, so that prompts
+        # are seen before their newline.
+        self.is_matched = any(self.regex.search(line) for line in lines)
+        self._pending[stream] = lines[-1][-MAX_PENDING_LINE:]
+
+
+class StreamWatcher(object):
+    """Feed the output of a running command to streaming matchers.
+
+    Engines call ``feed_stdout`` and ``feed_stderr`` with each chunk read
+    from the child, and stop it as soon as ``should_stop`` is true.
+
+    """
+    def __init__(self, matchers):
+        super(StreamWatcher, self).__init__()
+        self.matchers = matchers
+
+    @property
+    def should_stop(self):
+        return any(matcher.should_stop for matcher in self.matchers)
+
+    @property
+    def failure(self):
+        """The message of the first failed matcher, once the command is
+        done.
+
+        """
+        for matcher in self.matchers:
+            if matcher.failure is not None:
+                return matcher.failure
+        return None
+
+    def feed_stdout(self, data):
+        for matcher in self.matchers:
+            matcher.feed_stdout(data)
+
+    def feed_stderr(self, data):
+        for matcher in self.matchers:
+            matcher.feed_stderr(data)
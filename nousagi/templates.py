@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import atexit
+import os
+import re
+import shutil
+import string
+import tempfile
+import threading
+
+# Maximum number of renderings remembered per template.
+MAX_RENDERED = 64
+
+# Renderings of template files at least this long are written once aside,
+# and copied to each target.
+MIN_COPIED_SIZE = 1 << 20
+
+_templates = {}
+_regexes = {}
+_template_files = {}
+_template_files_lock = threading.Lock()
+_rendered_directory_path = None
+
+
+class CompiledTemplate(object):
+    """A ``string.Template`` that remembers its renderings.
+
+    Renderings are keyed by the values of the variables the template
+    references, so a rendering done at load time is reused by every test,
+    and is never reused when a variable registered at runtime shadows it.
+
+    """
+    def __init__(self, text):
+        super(CompiledTemplate, self).__init__()
+        self.template = string.Template(text)
+        self.names = _referenced_names(self.template)
+        self._rendered = {}
+
+    def render(self, variables):
+        if self.names is None:
+            # Invalid placeholders: let substitute raise as usual.
+            return self.template.substitute(variables)
+        try:
+            key = tuple(variables[name] for name in self.names)
+            return self._rendered[key]
+        except (KeyError, TypeError):
+            pass
+        rendered = self.template.substitute(variables)
+        try:
+            if len(self._rendered) < MAX_RENDERED:
+                self._rendered[key] = rendered
+        except TypeError:
+            # Unhashable variable values are rendered every time.
+            pass
+        return rendered
+
+    def prerender(self, variables):
+        """Render the template now if ``variables`` has everything it
+        references.
+
+        """
+        if self.names is not None and all(
+                name in variables for name in self.names):
+            self.render(variables)
+
+
+def _referenced_names(template):
+    names = set()
+    for match in template.pattern.finditer(template.template):
+        if match.group("invalid") is not None:
+            return None
+        name = match.group("named") or match.group("braced")
+        if name is not None:
+            names.add(name)
+    return tuple(sorted(names))
+
+
+def compile_template(text):
+    template = _templates.get(text)
+    if template is None:
+        template = _templates.setdefault(text, CompiledTemplate(text))
+    return template
+
+
+def render_template(text, variables):
+    """Substitute ``variables`` in the template ``text``."""
+    return compile_template(text).render(variables)
+
+
+def prerender_template(text, variables):
+    compile_template(text).prerender(variables)
+
+
+def compile_regex(pattern):
+    regex = _regexes.get(pattern)
+    if regex is None:
+        regex = _regexes.setdefault(pattern, re.compile(pattern))
+    return regex
+
+
+class TemplateFile(object):
+    """A template file, read once and read again only when its modification
+    time or size changes.
+
+    Large renderings are written once to a private directory, then copied
+    to each target, which lets the kernel copy the data.
+
+    """
+    def __init__(self, path, stat):
+        super(TemplateFile, self).__init__()
+        self.path = path
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+        with open(path, "rt") as fp:
+            self.template = CompiledTemplate(fp.read())
+        self._lock = threading.Lock()
+        self._copies = {}
+
+    def is_current(self, stat):
+        return self.mtime == stat.st_mtime_ns and self.size == stat.st_size
+
+    def write(self, target, variables):
+        rendered = self.template.render(variables)
+        if len(rendered) < MIN_COPIED_SIZE:
+            with open(target, "wt") as fp:
+                fp.write(rendered)
+        else:
+            shutil.copyfile(self._copy_of(rendered), target)
+
+    def _copy_of(self, rendered):
+        # Renderings are remembered by the template, so the same string, and
+        # its cached hash, comes back for the same variables.
+        with self._lock:
+            copy = self._copies.get(rendered)
+            if copy is None:
+                fd, copy = tempfile.mkstemp(dir=_rendered_directory())
+                with os.fdopen(fd, "wt") as fp:
+                    fp.write(rendered)
+                if len(self._copies) < MAX_RENDERED:
+                    self._copies[rendered] = copy
+            return copy
+
+
+def _rendered_directory():
+    global _rendered_directory_path
+    with _template_files_lock:
+        if _rendered_directory_path is None:
+            _rendered_directory_path = tempfile.mkdtemp(prefix="nousagi-")
+            atexit.register(
+                shutil.rmtree, _rendered_directory_path, ignore_errors=True
+            )
+        return _rendered_directory_path
+
+
+def write_template_file(source, target, variables):
+    """Render the template file ``source`` with ``variables`` into
+    ``target``.
+
+    """
+    path = os.path.abspath(source)
+    stat = os.stat(path)
+    template_file = _template_files.get(path)
+    if template_file is None or not template_file.is_current(stat):
+        with _template_files_lock:
+            template_file = _template_files.get(path)
+            if template_file is None or not template_file.is_current(stat):
+                template_file = TemplateFile(path, stat)
+                _template_files[path] = template_file
+    template_file.write(target, variables)
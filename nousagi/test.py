@@ -1,43 +1,60 @@
 import os
-import string
-import subprocess
-
-from characteristic import Attribute, attributes
+import threading
+import time
 
 from .assertions import (
     CommandAssertion, FileExists, OutputAssertion,
     OutputStartswithAssertion, RegexOutputAssertion, StatusAssertion
 )
-from .config import Config
+from .capture import to_bytes
+from .exceptions import NousagiTestError
 from .pre_runs import State
+from .process import (
+    CANCELLED_MESSAGE, command_from_json_dict, prerender_command,
+    render_command, run_command
+)
+from .results import result_stream
+from .slotted import Slotted, check_type
+from .streaming import StreamWatcher, UntilMatcher
+from .templates import compile_regex, prerender_template, render_template
+from .tracing import tracer
+
+
+# Serializes building lazy tests, which happens once per test.
+_build_lock = threading.Lock()
 
 
 def _run_pre_runs(pre_runs, state):
     return_states = []
-    for pre_run in pre_runs:
-        return_state = pre_run.run(state)
-        return_states.append(return_state)
+    with tracer.span("pre_run"):
+        for pre_run in pre_runs:
+            return_state = pre_run.run(state)
+            return_states.append(return_state)
     return return_states
 
 
 def _run_post_runs(post_runs, state, return_states):
-    for post_run in post_runs:
-        post_run.run(state)
-    for return_state in reversed(return_states):
-        return_state.cleanup()
-
-
-@attributes([
-    Attribute("name", instance_of=str),
-    Attribute("cmd", instance_of=str),
-    Attribute("assertions", instance_of=list),
-    Attribute("pre_runs", instance_of=list),
-    Attribute("post_runs", instance_of=list),
-    Attribute("config", instance_of=Config),
-])
-class Test(object):
+    with tracer.span("post_run"):
+        for post_run in post_runs:
+            post_run.run(state)
+        for return_state in reversed(return_states):
+            return_state.cleanup()
+
+
+class Test(Slotted):
+    __slots__ = (
+        "name", "cmd", "assertions", "pre_runs", "post_runs", "config",
+        "timeout", "until", "stream",
+    )
+
+    _defaults = {"timeout": None, "until": None, "stream": False}
+
     @classmethod
-    def from_json_dict(cls, config, data, pre_runs, post_runs):
+    def from_json_dict(cls, config, data, pre_runs, post_runs, timeout=None):
+        check_type("name", data["name"], str)
+        timeout = data.get("timeout", timeout)
+        if timeout is not None:
+            check_type("timeout", timeout, (int, float))
         assertions = []
         pre_runs = pre_runs
         post_runs = post_runs
@@ -50,14 +67,12 @@ class Test(object):
         }
 
         if "status" in data:
-            assertion = StatusAssertion(
-                variables=config.variables, expected=data["status"]
+            assertion = StatusAssertion.from_json_dict(
+                config.variables, {"expected": data["status"]}
             )
             assertions.append(assertion)
         if "output" in data:
-            assertion = OutputAssertion(
-                variables=config.variables, expected=data["output"]
-            )
+            assertion = OutputAssertion.from_json_dict(config.variables, data)
             assertions.append(assertion)
 
         if "assertions" in data:
@@ -71,14 +86,26 @@ class Test(object):
                     assertion = factory.from_json_dict(config.variables, assertion_data)
                     assertions.append(assertion)
 
+        # Everything not depending on variables registered at runtime is
+        # rendered once, here.
+        cmd = command_from_json_dict(data, "cmd", config.shell)
+        prerender_command(cmd, config.variables)
+        if "until" in data:
+            prerender_template(data["until"], config.variables)
+
         return cls(
-            name=data["name"], cmd=data["cmd"], assertions=assertions,
-            pre_runs=pre_runs, post_runs=post_runs, config=config
+            name=data["name"], cmd=cmd, assertions=assertions,
+            pre_runs=pre_runs, post_runs=post_runs, config=config,
+            timeout=timeout, until=data.get("until"),
+            stream=data.get("stream", False),
         )
 
     def run(self, case):
-        state = State(variables=self.config.variables, environ=os.environ.copy())
-        return self.run_from_state(case, state)
+        state = State(
+            variables=dict(self.config.variables), environ=os.environ.copy()
+        )
+        with tracer.span("test", self.name):
+            return self.run_from_state(case, state)
 
     def run_from_state(self, case, state):
         return_states = _run_pre_runs(self.pre_runs, state)
@@ -89,48 +116,155 @@ class Test(object):
             _run_post_runs(self.post_runs, state, return_states)
 
     def _run_command(self, case, state):
-        cmd = string.Template(self.cmd).substitute(**state.variables)
+        cmd = render_command(self.cmd, state.variables)
+        runner = self.config.runner
         if self.config.coverage.is_enabled:
-            cmd = self.config.coverage.prefix + " " + cmd
+            cmd = self.config.coverage.prefix_command(cmd)
+            # coverage starts its own interpreter.
+            runner = None
+        if runner is None:
+            run = run_command
+        else:
+            run = runner.run
 
-        p = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            stdin=subprocess.PIPE, shell=True, env=state.environ
-        )
-        stdout, stderr = p.communicate()
+        watcher = self._create_watcher(state.variables)
+        with tracer.span("command", self.name):
+            start = time.perf_counter()
+            result = run(
+                cmd, env=state.environ, timeout=self.timeout, watcher=watcher
+            )
+            duration = time.perf_counter() - start
+        try:
+            result_stream.add_command(result, duration)
+            if result.cancelled:
+                case.skipTest(CANCELLED_MESSAGE)
+            if result.timed_out:
+                msg = "Command {0!r} timed out after {1}s"
+                case.fail(msg.format(cmd, self.timeout))
+            if watcher is not None and watcher.failure is not None:
+                case.fail(watcher.failure)
 
-        for assertion in self.assertions:
-            assertion.uphold(state.variables, case, stdout, stderr, p.returncode)
+            for assertion in self.assertions:
+                if result.stopped and isinstance(assertion, StatusAssertion):
+                    # Stopped by ``until``: the status is the one of the
+                    # signal nousagi sent, not one the command chose.
+                    continue
+                with tracer.span("assertion", type(assertion).__name__):
+                    assertion.uphold(
+                        state.variables, case, result.stdout, result.stderr,
+                        result.returncode
+                    )
+        finally:
+            result.output.close()
+
+    def _create_watcher(self, variables):
+        matchers = []
+        if self.stream:
+            for assertion in self.assertions:
+                matcher = assertion.stream_matcher(variables)
+                if matcher is not None:
+                    matchers.append(matcher)
+        if self.until is not None:
+            until = render_template(self.until, variables)
+            matchers.append(UntilMatcher(compile_regex(to_bytes(until))))
+        if len(matchers) == 0:
+            return None
+        return StreamWatcher(matchers)
 
 
-@attributes([
-    Attribute("name", instance_of=str),
-    Attribute("config", instance_of=Config),
-    Attribute("tests", instance_of=list),
-    Attribute("pre_runs", instance_of=list),
-    Attribute("post_runs", instance_of=list),
-])
-class Scenario(object):
+class Scenario(Slotted):
+    __slots__ = ("name", "config", "tests", "pre_runs", "post_runs")
+
     @classmethod
-    def from_json_dict(cls, config, data, pre_runs, post_runs):
+    def from_json_dict(cls, config, data, pre_runs, post_runs, timeout=None):
         name = data["name"]
+        check_type("name", name, str)
+        timeout = data.get("timeout", timeout)
+        for step in data["steps"]:
+            if "fail-fast" in step:
+                # Only whole tests and scenarios are cancelled.
+                msg = "'fail-fast' is not supported on step {0!r} of {1!r}"
+                raise NousagiTestError(msg.format(step.get("name"), name))
 
         tests = [
-            Test.from_json_dict(config, step, [], [])
+            Test.from_json_dict(config, step, [], [], timeout)
             for step in data["steps"]
         ]
 
         return cls(
             name=name, config=config, tests=tests, pre_runs=pre_runs,
-            post_runs=post_runs
+            post_runs=post_runs,
+        )
+
+    def run(self, case):
+        state = State(
+            variables=dict(self.config.variables), environ=os.environ.copy()
         )
 
+        with tracer.span("scenario", self.name):
+            return_states = _run_pre_runs(self.pre_runs, state)
+            try:
+                for test in self.tests:
+                    test.run_from_state(case, state)
+            finally:
+                _run_post_runs(self.post_runs, state, return_states)
+
+
+class LazyTest(object):
+    """A test or scenario only built from its data the first time it runs,
+    so that loading a file does not pay for the tests left unrun.
+
+    Only the name of the test is checked when loading; the rest of its data
+    is checked once, when building it.
+
+    Parameters
+    ----------
+    factory : type
+        ``Test`` or ``Scenario``.
+    context : TestContext
+        What the tests of the case share.
+    data : dict
+        The YAML data of the test.
+
+    """
+    __slots__ = ("factory", "context", "data", "_test")
+
+    def __init__(self, factory, context, data):
+        check_type("name", data["name"], str)
+        self.factory = factory
+        self.context = context
+        self.data = data
+        self._test = None
+
+    @property
+    def name(self):
+        return self.data["name"]
+
+    @property
+    def fail_fast(self):
+        return self.data.get("fail-fast", False)
+
+    @property
+    def test(self):
+        """The built test."""
+        test = self._test
+        if test is None:
+            with _build_lock:
+                if self._test is None:
+                    context = self.context
+                    self._test = self.factory.from_json_dict(
+                        context.config, self.data, context.pre_runs,
+                        context.post_runs, context.timeout,
+                    )
+                test = self._test
+        return test
+
     def run(self, case):
-        state = State(variables=self.config.variables, environ=os.environ.copy())
+        return self.test.run(case)
 
-        return_states = _run_pre_runs(self.pre_runs, state)
-        try:
-            for test in self.tests:
-                test.run_from_state(case, state)
-        finally:
-            _run_post_runs(self.post_runs, state, return_states)
+
+class TestContext(Slotted):
+    """The config, steps and timeout shared by the tests of a case."""
+    __slots__ = ("config", "pre_runs", "post_runs", "timeout")
+
+    _defaults = {"timeout": None}
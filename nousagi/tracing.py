@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import atexit
+import json
+import math
+import os
+import threading
+import time
+
+# Percentiles reported for each phase in the summary.
+PERCENTILES = (50, 90, 99)
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, tracer, phase, name):
+        self._tracer = tracer
+        self._phase = phase
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._tracer.record(
+            self._phase, self._name, self._start, time.perf_counter()
+        )
+        return False
+
+
+class Tracer(object):
+    """Record how long each phase of loading and running tests takes.
+
+    Tracing is disabled until ``start`` is called; spans of a disabled
+    tracer record nothing. When the process exits, the spans are written as
+    a Chrome trace, viewable in ``chrome://tracing`` or Perfetto, and as a
+    JSON summary of the durations of each phase.
+
+    """
+    def __init__(self):
+        super(Tracer, self).__init__()
+        self.filename = None
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._events = []
+
+    @property
+    def is_enabled(self):
+        return self.filename is not None
+
+    def start(self, filename):
+        """Record spans from now on, written to ``filename`` at exit.
+
+        The summary is written next to it, as ``<name>.summary.json``.
+
+        """
+        if self.filename is None:
+            atexit.register(self.write)
+        self.filename = filename
+
+    def span(self, phase, name=None):
+        """A context manager recording the time spent in its block as
+        ``phase``, for the item called ``name``.
+
+        """
+        if self.filename is None:
+            return _NULL_SPAN
+        return _Span(self, phase, name)
+
+    def record(self, phase, name, start, end):
+        event = (phase, name, start, end, threading.current_thread().ident)
+        with self._lock:
+            self._events.append(event)
+
+    def write(self):
+        if self.filename is None:
+            return
+        with self._lock:
+            events = list(self._events)
+        with open(self.filename, "w") as fh:
+            json.dump(self.chrome_trace(events), fh)
+        with open(summary_filename(self.filename), "w") as fh:
+            json.dump(self.summary(events), fh, indent=2, sort_keys=True)
+
+    def chrome_trace(self, events):
+        pid = os.getpid()
+        trace_events = []
+        for phase, name, start, end, thread_id in events:
+            trace_event = {
+                "name": phase if name is None else name,
+                "cat": phase,
+                "ph": "X",
+                "ts": (start - self._origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": thread_id,
+            }
+            trace_events.append(trace_event)
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def summary(self, events):
+        """The count, total and percentiles of the durations of each
+        phase, in seconds.
+
+        """
+        durations = {}
+        for phase, name, start, end, thread_id in events:
+            durations.setdefault(phase, []).append(end - start)
+        phases = {}
+        for phase, values in durations.items():
+            values.sort()
+            stats = {
+                "count": len(values),
+                "total": sum(values),
+                "max": values[-1],
+            }
+            for percentile in PERCENTILES:
+                stats["p{0}".format(percentile)] = _percentile(
+                    values, percentile
+                )
+            phases[phase] = stats
+        if len(events) > 0:
+            wall = (max(event[3] for event in events)
+                    - min(event[2] for event in events))
+        else:
+            wall = 0.0
+        return {"wall_time": wall, "phases": phases}
+
+
+def _percentile(sorted_values, percentile):
+    # Nearest rank.
+    rank = int(math.ceil(percentile / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def summary_filename(filename):
+    return os.path.splitext(filename)[0] + ".summary.json"
+
+
+tracer = Tracer()
@@ -6,10 +6,16 @@
 # of the 3-clause BSD license.  See the LICENSE.txt file for details.
 from __future__ import absolute_import, unicode_literals
 
+import collections
+
 from six import string_types
-from stevedore.extension import ExtensionManager
+from six.moves import queue
 
 from .exceptions import InvalidVariable, InvalidVariableType, VariableLoopError
+from .plugins.registry import var_loaders
+
+# Maximum number of vars loaded concurrently for a single file.
+MAX_CONCURRENT_VARS = 16
 
 
 class StringVarLoader(object):
@@ -26,14 +32,7 @@ class VarLoader(object):
     def __init__(self, filename):
         super(VarLoader, self).__init__()
         self.filename = filename
-        loaders = ExtensionManager(
-            namespace='nousagi.var_loaders',
-        )
-        self.loaders = dict(
-            (name, loaders[name].plugin)
-            for name in loaders.names()
-        )
-        self.loader_keys = set(self.loaders.keys())
+        self.loaders = var_loaders
 
     def _create_loader(self, name, var):
         if isinstance(var, string_types):
@@ -44,11 +43,11 @@ class VarLoader(object):
             except KeyError:
                 raise InvalidVariableType(
                     'Missing type for var {0!r}'.format(name))
-            if loader_type not in self.loaders:
+            cls = self.loaders.get(loader_type)
+            if cls is None:
                 raise InvalidVariableType(
                     'Invalid type for var {0!r}: {1!r}'.format(
                         name, loader_type))
-            cls = self.loaders[loader_type]
             loader = cls.from_dict(name, var)
         else:
             raise InvalidVariable(name, repr(var))
@@ -67,14 +66,131 @@ class VarLoader(object):
         return loader.value
 
     def load_variables(self, var_dict):
-        variables = {}
+        """Load all the vars of ``var_dict``.
+
+        Loaders may declare the vars they need with ``dependencies``. A var
+        is loaded as soon as the vars it declares are, and vars that do not
+        depend on each other are loaded concurrently.
+
+        """
         loaders = self._create_loaders(var_dict)
-        while len(loaders) > 0:
-            loaded = set(loader for loader in loaders
-                         if loader.load(self.filename, variables))
-            if len(loaded) == 0:
-                raise VariableLoopError()
-            new_vars = ((loader.name, loader.value) for loader in loaded)
-            variables.update(new_vars)
-            loaders = [loader for loader in loaders if loader not in loaded]
+        names = set(loader.name for loader in loaders)
+        dependencies = dict(
+            (loader.name, _dependencies(loader) & names - set([loader.name]))
+            for loader in loaders
+        )
+        cycle = _find_cycle(dependencies)
+        if cycle is not None:
+            raise VariableLoopError(
+                'Vars depend on each other: {0}'.format(' -> '.join(cycle))
+            )
+
+        concurrent_count = sum(
+            1 for loader in loaders
+            if not isinstance(loader, StringVarLoader)
+        )
+        if concurrent_count <= 1:
+            return self._load_in_order(loaders, dependencies, None)
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(MAX_CONCURRENT_VARS, concurrent_count))
+        try:
+            return self._load_in_order(loaders, dependencies, pool)
+        finally:
+            pool.close()
+
+    def _load_in_order(self, loaders, dependencies, pool):
+        variables = {}
+        unmet = dict((name, len(deps)) for name, deps in dependencies.items())
+        dependents = collections.defaultdict(list)
+        for name, deps in dependencies.items():
+            for dep in deps:
+                dependents[dep].append(name)
+        by_name = dict((loader.name, loader) for loader in loaders)
+        ready = collections.deque(
+            loader for loader in loaders if unmet[loader.name] == 0
+        )
+        # Loaders reporting missing prerequisites we could not see in their
+        # references; they are retried whenever a new var is loaded.
+        retry = []
+        results = queue.Queue()
+        in_flight = 0
+
+        while len(ready) > 0 or in_flight > 0:
+            while len(ready) > 0:
+                loader = ready.popleft()
+                if pool is None or isinstance(loader, StringVarLoader):
+                    results.put(_load(loader, self.filename, variables))
+                else:
+                    pool.apply_async(
+                        _load, (loader, self.filename, dict(variables)),
+                        callback=results.put,
+                    )
+                in_flight += 1
+
+            loader, is_loaded, error = results.get()
+            in_flight -= 1
+            if error is not None:
+                raise error
+            if not is_loaded:
+                retry.append(loader)
+                continue
+            variables[loader.name] = loader.value
+            ready.extend(retry)
+            retry = []
+            for name in dependents[loader.name]:
+                unmet[name] -= 1
+                if unmet[name] == 0:
+                    ready.append(by_name[name])
+
+        unloaded = sorted(set(by_name) - set(variables))
+        if len(unloaded) > 0:
+            raise VariableLoopError(
+                'Could not load vars: {0}'.format(', '.join(unloaded))
+            )
         return variables
+
+
+def _load(loader, filename, variables):
+    try:
+        return loader, loader.load(filename, variables), None
+    except Exception as e:
+        return loader, False, e
+
+
+def _dependencies(loader):
+    """The names of the vars ``loader`` declares it needs; loaders without
+    ``dependencies`` need none.
+
+    """
+    dependencies = getattr(loader, 'dependencies', None)
+    if dependencies is None:
+        return set()
+    return set(dependencies())
+
+
+def _find_cycle(dependencies):
+    """Return a dependency cycle as a list of names, starting and ending
+    with the same name, or ``None``.
+
+    """
+    visiting, done = 1, 2
+    states = {}
+    for root in sorted(dependencies):
+        if root in states:
+            continue
+        states[root] = visiting
+        path = [root]
+        stack = [iter(sorted(dependencies[root]))]
+        while len(stack) > 0:
+            for name in stack[-1]:
+                if states.get(name) == visiting:
+                    return path[path.index(name):] + [name]
+                elif name not in states:
+                    states[name] = visiting
+                    path.append(name)
+                    stack.append(iter(sorted(dependencies[name])))
+                    break
+            else:
+                states[path.pop()] = done
+                stack.pop()
+    return None
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 David Cournapeau
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms
+# of the 3-clause BSD license.  See the LICENSE.txt file for details.
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout of cache entries changes.
+CACHE_VERSION = 2
+
+_loader_class = None
+
+
+def _get_loader_class():
+    global _loader_class
+    if _loader_class is None:
+        # yaml is slow to import, and not needed when every file is cached.
+        import yaml
+        # libyaml's parser is much faster than the pure python one.
+        base = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+        class InterningLoader(base):
+            # Keys, and values such as commands, repeat in every test of a
+            # file: interning them keeps a single copy of each.
+            def construct_yaml_str(self, node):
+                return sys.intern(self.construct_scalar(node))
+
+        InterningLoader.add_constructor(
+            "tag:yaml.org,2002:str", InterningLoader.construct_yaml_str
+        )
+        _loader_class = InterningLoader
+    return _loader_class
+
+
+def parse_yaml(stream):
+    import yaml
+    return yaml.load(stream, Loader=_get_loader_class())
+
+
+class YamlCache(object):
+    """An on-disk cache of parsed YAML test files.
+
+    Entries are pickled, and keyed by the file path. An entry is reused
+    without reading the file when its modification time and size are
+    unchanged, or after reading it when its content hash is unchanged.
+
+    Parameters
+    ----------
+    directory : str
+        The directory holding the cache entries, created if needed.
+
+    """
+    def __init__(self, directory):
+        super(YamlCache, self).__init__()
+        self.directory = directory
+
+    def load(self, filename):
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        entry_path = self._entry_path(filename)
+        entry = self._read_entry(entry_path)
+        if (entry is not None and entry["mtime"] == stat.st_mtime_ns
+                and entry["size"] == stat.st_size):
+            return entry["structure"]
+
+        with open(filename, "rb") as fh:
+            data = fh.read()
+        digest = hashlib.sha1(data).hexdigest()
+        if entry is not None and entry["digest"] == digest:
+            structure = entry["structure"]
+        else:
+            logger.debug('Parsing %r', filename)
+            structure = parse_yaml(data)
+        self._write_entry(entry_path, {
+            "version": CACHE_VERSION,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "digest": digest,
+            "structure": structure,
+        })
+        return structure
+
+    def _entry_path(self, filename):
+        key = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "yaml", key + ".pickle")
+
+    def _read_entry(self, entry_path):
+        try:
+            with open(entry_path, "rb") as fh:
+                entry = pickle.load(fh)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            logger.debug('Ignoring corrupted cache entry %r', entry_path)
+            return None
+        if entry.get("version") != CACHE_VERSION:
+            return None
+        return entry
+
+    def _write_entry(self, entry_path, entry):
+        directory = os.path.dirname(entry_path)
+        os.makedirs(directory, exist_ok=True)
+        # Written aside then renamed, so concurrent runs never see a
+        # partial entry.
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(entry, fh, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, entry_path)
+        except Exception:
+            os.remove(temp_path)
+            raise
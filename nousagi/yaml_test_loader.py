@@ -1,30 +1,78 @@
-import subprocess
-import sys
+import json
+import threading
+import types
 import unittest
 
-import six
-import yaml
-
 from .config import Config
-from .pre_runs import MultiSteps, pre_run_factory_from_json_dict
-from .test import Scenario, Test
+from .coverage_session import coverage_session
+from .pre_runs import (
+    MultiSteps, SharedSteps, pre_run_factory_from_json_dict
+)
+from .durations import test_key
+from .scheduler import SerialScheduler
+from .sharding import case_key
+from .templates import compile_template
+from .test import LazyTest, Scenario, Test, TestContext
+from .tracing import tracer
+from .yaml_cache import parse_yaml
 
 
 TEST_NAME_ATTRIBUTE = 'nousagi_name'
 
+# Session scoped pre-runs, keyed by their steps.
+_session_pre_runs = {}
+_session_pre_runs_lock = threading.Lock()
+
+
+class TestMethod(object):
+    # The test methods of generated ``TestCase`` classes. A single instance
+    # per test, bound to the ``TestCase`` on attribute access like a
+    # function, and exposing what the scheduler needs as attributes. It has
+    # no docstring, as ``unittest`` would use it to describe every test.
+    __slots__ = ("nousagi_test", "scheduler", "case_key")
+
+    def __init__(self, test, scheduler, case_key):
+        self.nousagi_test = test
+        self.scheduler = scheduler
+        self.case_key = case_key
+
+    @property
+    def nousagi_name(self):
+        return self.nousagi_test.name
 
-def _create_test_method(test):
-    def test_method(self):
-        test.run(self)
+    @property
+    def nousagi_duration_key(self):
+        return test_key(self.case_key, self.nousagi_test.name)
 
-    setattr(test_method, TEST_NAME_ATTRIBUTE, test.name)
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return types.MethodType(self, instance)
 
-    return test_method
+    def __call__(self, case):
+        self.scheduler.run(self.nousagi_test, case)
+
+
+class GeneratedYamlTestCase(unittest.TestCase):
+    """The base of the ``TestCase`` classes generated for each case."""
+    # The file and the name of the case, set on each generated class.
+    nousagi_filename = None
+    nousagi_name = None
+
+    def __str__(self):
+        method = getattr(self, self._testMethodName)
+        test_name = '{0}:{1}'.format(getattr(self, TEST_NAME_ATTRIBUTE),
+                                     getattr(method, TEST_NAME_ATTRIBUTE))
+        return '{0!r} ({1})'.format(test_name, self.nousagi_filename)
 
 
-def create_test_case_for_case(filename, config, case, pre_run_definitions):
+def create_test_case_for_case(filename, config, case, pre_run_definitions,
+                              scheduler=None, selection=None):
     """Programatically generate ``TestCases`` from a test specification.
 
+    Tests are only built from their specification when first run. If
+    ``selection`` is given, only the tests it accepts are generated.
+
     Returns
     -------
     test_case_cls : type
@@ -32,63 +80,95 @@ def create_test_case_for_case(filename, config, case, pre_run_definitions):
         generated tests, in the same order as defined in the file.
 
     """
+    if scheduler is None:
+        scheduler = SerialScheduler()
+
     pre_runs = [
-        pre_run_definitions[name]
+        _for_case(pre_run_definitions[name])
         for name in case.get('setup', [])
     ]
-    post_runs = []
+    context = TestContext(
+        config=config, pre_runs=pre_runs, post_runs=[],
+        timeout=case.get('timeout', config.timeout),
+    )
+    specs = [(Test, spec) for spec in case.get('tests', [])]
+    specs += [(Scenario, spec) for spec in case.get('scenarios', [])]
+    # Method names keep the index of the test in the whole case, whatever
+    # tests are selected.
+    test_count = len(specs)
     tests = [
-        Test.from_json_dict(config, spec, pre_runs, post_runs)
-        for spec in case.get('tests', [])
-    ]
-    tests += [
-        Scenario.from_json_dict(config, spec, pre_runs, post_runs)
-        for spec in case.get('scenarios', [])
+        (index, LazyTest(factory, context, spec))
+        for index, (factory, spec) in enumerate(specs)
+        if selection is None or selection.accepts(case, spec)
     ]
-    test_count = len(tests)
+    key = case_key(filename, case['name'])
+    for pre_run in pre_runs:
+        if isinstance(pre_run, SharedSteps):
+            pre_run.add_users(len(tests))
     class_dict = dict(
         ('test_{index:0>{test_count}}'.format(
             index=index, test_count=test_count),
-         _create_test_method(test))
-        for index, test in enumerate(tests)
+         TestMethod(test, scheduler, key))
+        for index, test in tests
     )
+    class_dict['nousagi_filename'] = filename
     class_dict[TEST_NAME_ATTRIBUTE] = case['name']
 
     if 'max-diff' in case:
         class_dict['maxDiff'] = case['max-diff']
 
-    def __str__(self):
-        method = getattr(self, self._testMethodName)
-        template = '{0!r} ({1})'
-        test_name = '{0}:{1}'.format(getattr(self, TEST_NAME_ATTRIBUTE),
-                                     getattr(method, TEST_NAME_ATTRIBUTE))
-        str_filename = filename
-        if six.PY2:
-            encoding = sys.getdefaultencoding()
-            template = template.encode(encoding)
-            test_name = test_name.encode(encoding)
-            if isinstance(str_filename, six.text_type):
-                str_filename = filename.encode(encoding)
-        return template.format(
-            test_name,
-            str_filename,
-        )
-
-    class_dict['__str__'] = __str__
-
-    class_name = 'GeneratedYamlTestCase'
-    if six.PY2:
-        class_name = class_name.encode('ascii')
-    return type(class_name, (unittest.TestCase,), class_dict)
+    # haas identifies tests by class and method name, so each case still
+    # gets its own class.
+    return type('GeneratedYamlTestCase', (GeneratedYamlTestCase,), class_dict)
 
 
 def create_pre_run_set(filename, config, pre_run_set):
+    """Create the pre-run of a definition, either a list of steps, or a
+    dict with the ``steps`` and the ``scope`` sharing them.
+
+    """
+    scope = "test"
+    if isinstance(pre_run_set, dict):
+        scope = pre_run_set.get("scope", scope)
+        pre_run_set = pre_run_set["steps"]
     pre_runs = [
         pre_run_factory_from_json_dict(step)
         for step in pre_run_set
     ]
 
-    return MultiSteps(steps=pre_runs)
+    steps = MultiSteps(steps=pre_runs)
+    if scope == "test":
+        return steps
+    elif scope == "session":
+        # Steps are rendered with the vars of the first file running them:
+        # only files giving the same values to those vars share them.
+        values = sorted(
+            (name, repr(config.variables.get(name)))
+            for name in _template_names(pre_run_set)
+        )
+        key = json.dumps([pre_run_set, values], sort_keys=True)
+        with _session_pre_runs_lock:
+            if key not in _session_pre_runs:
+                _session_pre_runs[key] = SharedSteps(steps, scope)
+            return _session_pre_runs[key]
+    return SharedSteps(steps, scope)
+
+
+def _template_names(data):
+    """The names referenced as ``$name`` or ``${name}`` in ``data``."""
+    if isinstance(data, str):
+        return set(compile_template(data).names or ())
+    elif isinstance(data, dict):
+        data = list(data.values())
+    if isinstance(data, list):
+        return set().union(*(_template_names(item) for item in data))
+    return set()
+
+
+def _for_case(pre_run):
+    if isinstance(pre_run, SharedSteps):
+        return pre_run.for_case()
+    return pre_run
 
 
 class YamlTestLoader(object):
@@ -99,47 +179,95 @@ class YamlTestLoader(object):
     ----------
     loader : haas.loader.Loader
         The ``haas`` test loader.
+    scheduler : SerialScheduler or ParallelScheduler, optional
+        Decides when and where the generated tests run. Tests run inline,
+        one after another, by default.
+    cache : YamlCache, optional
+        If given, the on-disk cache of parsed YAML files.
+    case_filter : callable, optional
+        If given, called with the file name and the data of each case, and
+        only the cases for which it returns true are loaded.
+    selection : TestSelection, optional
+        If given, only the tests it selects are loaded.
 
     """
 
-    def __init__(self, loader):
+    def __init__(self, loader, scheduler=None, cache=None, case_filter=None,
+                 selection=None):
         super(YamlTestLoader, self).__init__()
         self._loader = loader
+        if scheduler is None:
+            scheduler = SerialScheduler()
+        self._scheduler = scheduler
+        self._cache = cache
+        self._case_filter = case_filter
+        self._selection = selection
 
-    def load_tests_from_file(self, filename):
+    def load_tests_from_file(self, filename, selection=None):
         """Load the YAML test file and create a ``TestSuite`` containing all
         test cases contained in the file.
 
+        If given, ``selection`` replaces the selection of the loader for
+        this file.
+
         """
-        with open(filename) as fh:
-            test_structure = yaml.safe_load(fh)
-        return self.load_tests_from_yaml(test_structure, filename)
+        with tracer.span("parse", filename):
+            if self._cache is not None:
+                test_structure = self._cache.load(filename)
+            else:
+                with open(filename, "rb") as fh:
+                    test_structure = parse_yaml(fh)
+        return self.load_tests_from_yaml(test_structure, filename, selection)
 
-    def load_tests_from_yaml(self, test_structure, filename):
+    def load_tests_from_yaml(self, test_structure, filename, selection=None):
         """Create a ``TestSuite`` containing all test cases contained in the
         yaml structure.
 
+        Cases without any selected test are skipped before the config of
+        the file is loaded, and only the pre-run definitions used by the
+        cases left are created.
+
         """
         loader = self._loader
+        if selection is None:
+            selection = self._selection
+        if selection is not None and selection.is_empty:
+            selection = None
+
+        case_specs = test_structure['cases']
+        if self._case_filter is not None or selection is not None:
+            case_specs = [
+                case for case in case_specs
+                if (self._case_filter is None
+                    or self._case_filter(filename, case))
+                and (selection is None or selection.accepts_case(case))
+            ]
+            if len(case_specs) == 0:
+                # Nothing to run: vars are not even loaded.
+                return loader.create_suite()
 
-        config = Config.from_dict(test_structure.get('config', {}), filename)
-        if config.coverage.is_enabled and config.coverage.reset:
-            cmd = ["coverage", "erase"]
-            if config.coverage.coveragerc:
-                cmd += ["--rcfile", config.coverage.coveragerc]
-            subprocess.check_output(cmd)
+        with tracer.span("config", filename):
+            config = Config.from_dict(
+                test_structure.get('config', {}), filename
+            )
+        coverage_session.prepare(config.coverage)
 
+        used = set(
+            name for case in case_specs for name in case.get('setup', [])
+        )
         pre_run_definitions = dict(
             (name, create_pre_run_set(filename, config, pre_run_set))
             for name, pre_run_set
             in test_structure.get("pre_run_definitions", {}).items()
+            if name in used
         )
 
         cases = (
             create_test_case_for_case(
-                filename, config, case, pre_run_definitions
+                filename, config, case, pre_run_definitions, self._scheduler,
+                selection,
             )
-            for case in test_structure['cases']
+            for case in case_specs
         )
         tests = [loader.load_case(case) for case in cases]
         return loader.create_suite(tests)
@@ -6,7 +6,6 @@
 # of the 3-clause BSD license.  See the LICENSE.txt file for details.
 import os
 import re
-import sys
 import subprocess
 
 from setuptools import setup
@@ -112,9 +111,6 @@ if __name__ == "__main__":
         'six',
         'stevedore',
     ]
-    py26_requires = ['unittest2']
-    if sys.version_info < (2, 7):
-        install_requires += py26_requires
 
     write_version_py()
     from nousagi import __version__
@@ -138,14 +134,17 @@ if __name__ == "__main__":
             'Operating System :: POSIX',
             'Operating System :: Unix',
             'Programming Language :: Python',
+            'Programming Language :: Python :: 3',
+            'Programming Language :: Python :: 3 :: Only',
             'Topic :: Software Development',
             'Topic :: Software Development :: Testing',
         ],
         description='CLI testing for haas',
         long_description=long_description,
         license='BSD',
-        packages=['nousagi'],
+        packages=['nousagi', 'nousagi.plugins'],
         install_requires=install_requires,
+        python_requires='>=3.8',
         entry_points={
             'haas.discovery': [
                 'nousagi = nousagi.discoverer:CLITestDiscoverer',